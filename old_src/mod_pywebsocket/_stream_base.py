@@ -138,7 +138,17 @@ class StreamBase(object):
             ConnectionTerminatedException: when read returns empty string.
         """
 
-        bytes = []
+        if length <= 0:
+            return ''
+
+        # Blocking reads usually return everything at once. Return that
+        # without going through a list and join.
+        new_bytes = self._read(length)
+        length -= len(new_bytes)
+        if length <= 0:
+            return new_bytes
+
+        bytes = [new_bytes]
         while length > 0:
             new_bytes = self._read(length)
             bytes.append(new_bytes)
@@ -153,12 +163,18 @@ class StreamBase(object):
             ConnectionTerminatedException: when read returns empty string.
         """
 
+        # Reading ahead to find delim_char would block: the connection's read
+        # waits until all of the requested bytes arrive, and the peer may not
+        # send anything after delim_char until we respond. Read byte by byte
+        # from the (buffered) connection with the loop kept as tight as
+        # possible.
+        read = self._read
         bytes = []
-        while True:
-            ch = self._read(1)
-            if ch == delim_char:
-                break
-            bytes.append(ch)
+        append = bytes.append
+        ch = read(1)
+        while ch != delim_char:
+            append(ch)
+            ch = read(1)
         return ''.join(bytes)
 
 
@@ -94,7 +94,13 @@ class StreamHixie75(StreamBase):
             raise BadOperationException(
                 'Requested send_message after sending out a closing handshake')
 
-        self._write(''.join(['\x00', message.encode('utf-8'), '\xff']))
+        if isinstance(message, unicode):
+            encoded_message = message.encode('utf-8')
+        else:
+            # Accept ASCII str as str.encode would, without re-encoding it.
+            message.decode('ascii')
+            encoded_message = message
+        self._write(''.join(['\x00', encoded_message, '\xff']))
 
     def _read_payload_length_hixie75(self):
         """Reads a length header in a Hixie75 version frame with length.
@@ -103,14 +109,15 @@ class StreamHixie75(StreamBase):
             ConnectionTerminatedException: when read returns empty string.
         """
 
+        # Reads are served from the connection's buffered file object, so
+        # reading a byte at a time doesn't cost a syscall per byte.
+        read = self._read
         length = 0
         while True:
-            b_str = self._read(1)
-            b = ord(b_str)
-            length = length * 128 + (b & 0x7f)
-            if (b & 0x80) == 0:
-                break
-        return length
+            b = ord(read(1))
+            length = (length << 7) | (b & 0x7f)
+            if not b & 0x80:
+                return length
 
     def receive_message(self):
         """Receive a WebSocket frame and return its payload an unicode string.
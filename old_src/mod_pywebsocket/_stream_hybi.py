@@ -52,8 +52,16 @@ from mod_pywebsocket._stream_base import StreamBase
 from mod_pywebsocket._stream_base import UnsupportedFrameException
 
 
-_NOOP_MASKER = util.NoopMasker()
-
+# Length headers with a 16 bit and a 64 bit extended payload length, and
+# whole frame headers for each of the three payload length encodings.
+_LENGTH_HEADER_16_STRUCT = struct.Struct('!BH')
+_LENGTH_HEADER_64_STRUCT = struct.Struct('!BQ')
+_HEADER_STRUCT = struct.Struct('!BB')
+_HEADER_16_STRUCT = struct.Struct('!BBH')
+_HEADER_64_STRUCT = struct.Struct('!BBQ')
+# Extended payload lengths and close status codes.
+_UINT16_STRUCT = struct.Struct('!H')
+_UINT64_STRUCT = struct.Struct('!Q')
 
 class Frame(object):
 
@@ -92,9 +100,9 @@ def create_length_header(length, mask):
     elif length <= 125:
         return chr(mask_bit | length)
     elif length < (1 << 16):
-        return chr(mask_bit | 126) + struct.pack('!H', length)
+        return _LENGTH_HEADER_16_STRUCT.pack(mask_bit | 126, length)
     elif length < (1 << 63):
-        return chr(mask_bit | 127) + struct.pack('!Q', length)
+        return _LENGTH_HEADER_64_STRUCT.pack(mask_bit | 127, length)
     else:
         raise ValueError('Payload is too big for one frame')
 
@@ -115,15 +123,23 @@ def create_header(opcode, payload_length, fin, rsv1, rsv2, rsv3, mask):
     if (fin | rsv1 | rsv2 | rsv3) & ~1:
         raise ValueError('FIN bit and Reserved bit parameter must be 0 or 1')
 
-    header = ''
-
     first_byte = ((fin << 7)
                   | (rsv1 << 6) | (rsv2 << 5) | (rsv3 << 4)
                   | opcode)
-    header += chr(first_byte)
-    header += create_length_header(payload_length, mask)
+    if mask:
+        mask_bit = 1 << 7
+    else:
+        mask_bit = 0
 
-    return header
+    # Pack the whole header at once. This is create_length_header inlined.
+    if payload_length <= 125:
+        return _HEADER_STRUCT.pack(first_byte, mask_bit | payload_length)
+    elif payload_length < (1 << 16):
+        return _HEADER_16_STRUCT.pack(first_byte, mask_bit | 126,
+                                      payload_length)
+    else:
+        return _HEADER_64_STRUCT.pack(first_byte, mask_bit | 127,
+                                      payload_length)
 
 
 def _build_frame(header, body, mask):
@@ -133,7 +149,7 @@ def _build_frame(header, body, mask):
     masking_nonce = os.urandom(4)
     masker = util.RepeatedXorMasker(masking_nonce)
 
-    return header + masking_nonce + masker.mask(body)
+    return ''.join([header, masking_nonce, masker.mask(body)])
 
 
 def _filter_and_format_frame_object(frame, mask, frame_filters):
@@ -150,6 +166,11 @@ def create_binary_frame(
     message, opcode=common.OPCODE_BINARY, fin=1, mask=False, frame_filters=[]):
     """Creates a simple binary frame with no extension, reserved bit."""
 
+    if not frame_filters:
+        # Nothing can change the frame. Skip building a Frame object.
+        header = create_header(opcode, len(message), fin, 0, 0, 0, mask)
+        return _build_frame(header, message, mask)
+
     frame = Frame(fin=fin, opcode=opcode, payload=message)
     return _filter_and_format_frame_object(frame, mask, frame_filters)
 
@@ -158,7 +179,13 @@ def create_text_frame(
     message, opcode=common.OPCODE_TEXT, fin=1, mask=False, frame_filters=[]):
     """Creates a simple text frame with no extension, reserved bit."""
 
-    encoded_message = message.encode('utf-8')
+    if isinstance(message, unicode):
+        encoded_message = message.encode('utf-8')
+    else:
+        # A str is accepted only if it's ASCII, as str.encode would do, but
+        # is used as is instead of being decoded and encoded back.
+        message.decode('ascii')
+        encoded_message = message
     return create_binary_frame(encoded_message, opcode, fin, mask,
                                frame_filters)
 
@@ -222,8 +249,7 @@ def parse_frame(receive_bytes, logger=None,
                    'Receive 8-octet extended payload length')
 
         extended_payload_length = receive_bytes(8)
-        payload_length = struct.unpack(
-            '!Q', extended_payload_length)[0]
+        payload_length = _UINT64_STRUCT.unpack(extended_payload_length)[0]
         if payload_length > 0x7FFFFFFFFFFFFFFF:
             raise InvalidFrameException(
                 'Extended payload length >= 2^63')
@@ -238,8 +264,7 @@ def parse_frame(receive_bytes, logger=None,
                    'Receive 2-octet extended payload length')
 
         extended_payload_length = receive_bytes(2)
-        payload_length = struct.unpack(
-            '!H', extended_payload_length)[0]
+        payload_length = _UINT16_STRUCT.unpack(extended_payload_length)[0]
         if ws_version >= 13 and payload_length < 126:
             valid_length_encoding = False
             length_encoding_bytes = 2
@@ -254,6 +279,8 @@ def parse_frame(receive_bytes, logger=None,
             payload_length,
             length_encoding_bytes)
 
+    fine_enabled = logger.isEnabledFor(common.LOGLEVEL_FINE)
+
     if mask == 1:
         logger.log(common.LOGLEVEL_FINE, 'Receive mask')
 
@@ -261,28 +288,31 @@ def parse_frame(receive_bytes, logger=None,
         masker = util.RepeatedXorMasker(masking_nonce)
 
         logger.log(common.LOGLEVEL_FINE, 'Mask=%r', masking_nonce)
-    else:
-        masker = _NOOP_MASKER
 
     logger.log(common.LOGLEVEL_FINE, 'Receive payload data')
-    if logger.isEnabledFor(common.LOGLEVEL_FINE):
+    if fine_enabled:
         receive_start = time.time()
 
     raw_payload_bytes = receive_bytes(payload_length)
 
-    if logger.isEnabledFor(common.LOGLEVEL_FINE):
+    if fine_enabled:
         logger.log(
             common.LOGLEVEL_FINE,
             'Done receiving payload data at %s MB/s',
             payload_length / (time.time() - receive_start) / 1000 / 1000)
+
+    if mask == 0:
+        # Nothing to unmask.
+        return opcode, raw_payload_bytes, fin, rsv1, rsv2, rsv3
+
     logger.log(common.LOGLEVEL_FINE, 'Unmask payload data')
 
-    if logger.isEnabledFor(common.LOGLEVEL_FINE):
+    if fine_enabled:
         unmask_start = time.time()
 
     bytes = masker.mask(raw_payload_bytes)
 
-    if logger.isEnabledFor(common.LOGLEVEL_FINE):
+    if fine_enabled:
         logger.log(
             common.LOGLEVEL_FINE,
             'Done unmasking payload data at %s MB/s',
@@ -379,7 +409,7 @@ def create_closing_handshake_body(code, reason):
             raise BadOperationException('Status code is reserved pseudo '
                 'code')
         encoded_reason = reason.encode('utf-8')
-        body = struct.pack('!H', code) + encoded_reason
+        body = _UINT16_STRUCT.pack(code) + encoded_reason
     return body
 
 
@@ -638,8 +668,8 @@ class Stream(StreamBase):
                 'If a close frame has status code, the length of '
                 'status code must be 2 octet')
         elif len(message) >= 2:
-            self._request.ws_close_code = struct.unpack(
-                '!H', message[0:2])[0]
+            self._request.ws_close_code = _UINT16_STRUCT.unpack(
+                message[0:2])[0]
             self._request.ws_close_reason = message[2:].decode(
                 'utf-8', 'replace')
             self._logger.debug(
@@ -34,7 +34,6 @@
 
 import logging
 import os
-import re
 
 from mod_pywebsocket import common
 from mod_pywebsocket import handshake
@@ -44,13 +43,18 @@ from mod_pywebsocket import stream
 from mod_pywebsocket import util
 
 
-_SOURCE_PATH_PATTERN = re.compile(r'(?i)_wsh\.py$')
 _SOURCE_SUFFIX = '_wsh.py'
 _DO_EXTRA_HANDSHAKE_HANDLER_NAME = 'web_socket_do_extra_handshake'
 _TRANSFER_DATA_HANDLER_NAME = 'web_socket_transfer_data'
 _PASSIVE_CLOSING_HANDSHAKE_HANDLER_NAME = (
     'web_socket_passive_closing_handshake')
 
+# (source text, code object) of the handler sources compiled so far, keyed by
+# the source path. Constructing another Dispatcher over unchanged handler files
+# then skips compilation. An edited file replaces the entry of its previous
+# version.
+_handler_code_cache = {}
+
 
 class DispatchException(Exception):
     """Exception in dispatching WebSocket request."""
@@ -116,11 +120,13 @@ def _enumerate_handler_file_paths(directory):
     in the given directory.
     """
 
+    suffix_len = len(_SOURCE_SUFFIX)
     for root, unused_dirs, files in os.walk(directory):
         for base in files:
-            path = os.path.join(root, base)
-            if _SOURCE_PATH_PATTERN.search(path):
-                yield path
+            # Handler file names are matched case-insensitively. Only the
+            # tail of the name needs lowercasing for that.
+            if base[-suffix_len:].lower() == _SOURCE_SUFFIX:
+                yield os.path.join(root, base)
 
 
 class _HandlerSuite(object):
@@ -133,17 +139,42 @@ class _HandlerSuite(object):
         self.passive_closing_handshake = passive_closing_handshake
 
 
-def _source_handler_file(handler_definition):
+def _read_handler_file(path):
+    """Reads the whole handler source file at path in one read call."""
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        # Ask for one byte more than the size. Getting no more than size bytes
+        # back means the end of the file has been reached.
+        chunks = [os.read(fd, size + 1)]
+        while len(chunks[-1]) > size:
+            # The file has grown since fstat. Read the rest.
+            chunks.append(os.read(fd, size + 1))
+        return ''.join(chunks)
+    finally:
+        os.close(fd)
+
+
+def _source_handler_file(handler_definition, path='<string>'):
     """Source a handler definition string.
 
     Args:
         handler_definition: a string containing Python statements that define
                             handler functions.
+        path: the file the handler definition was read from. Used in
+              tracebacks and as part of the compiled code cache key.
     """
 
     global_dic = {}
     try:
-        exec handler_definition in global_dic
+        cached = _handler_code_cache.get(path)
+        if cached is not None and cached[0] == handler_definition:
+            code = cached[1]
+        else:
+            code = compile(handler_definition, path, 'exec')
+            _handler_code_cache[path] = (handler_definition, code)
+        exec code in global_dic
     except Exception:
         raise DispatchException('Error in sourcing handler:' +
                                 util.get_stack_trace())
@@ -221,12 +252,11 @@ class Dispatcher(object):
             alias_resource_path: alias resource path
             existing_resource_path: existing resource path
         """
-        try:
-            handler_suite = self._handler_suite_map[existing_resource_path]
-            self._handler_suite_map[alias_resource_path] = handler_suite
-        except KeyError:
+        handler_suite = self._handler_suite_map.get(existing_resource_path)
+        if handler_suite is None:
             raise DispatchException('No handler for: %r' %
                                     existing_resource_path)
+        self._handler_suite_map[alias_resource_path] = handler_suite
 
     def source_warnings(self):
         """Return warnings in sourcing handlers."""
@@ -372,7 +402,8 @@ class Dispatcher(object):
                     path)
                 continue
             try:
-                handler_suite = _source_handler_file(open(path).read())
+                handler_suite = _source_handler_file(
+                    _read_handler_file(path), path)
             except DispatchException, e:
                 self._source_warnings.append('%s: %s' % (path, e))
                 continue
@@ -381,7 +412,7 @@ class Dispatcher(object):
                 self._logger.debug(
                     'Path to resource conversion on %s failed' % path)
             else:
-                self._handler_suite_map[convert(path)] = handler_suite
+                self._handler_suite_map[resource] = handler_suite
 
 
 # vi:sts=4 sw=4 et
@@ -175,7 +175,9 @@ class MessageSender(threading.Thread):
     """This class sends messages to the client.
 
     This class provides both synchronous and asynchronous ways to send
-    messages.
+    messages. Synchronous sends are written on the calling thread once the
+    asynchronously sent messages before them are out. Asynchronous sends are
+    written by this thread, which is started on the first of them.
 
     Note: This class should not be used with the standalone server for wss
     because pyOpenSSL used by the server raises a fatal error if the socket
@@ -192,28 +194,63 @@ class MessageSender(threading.Thread):
         self._request = request
         self._queue = Queue.Queue()
         self.setDaemon(True)
-        self.start()
+
+        # Guards _pending and _thread_started. Never held while writing.
+        self._lock = threading.Lock()
+        # Notified when all the messages queued by send_nowait are written.
+        self._idle = threading.Condition(self._lock)
+        # Number of messages queued by send_nowait not written yet.
+        self._pending = 0
+        # The thread is started when send_nowait is first called.
+        self._thread_started = False
+        # Serializes the writes of send() and of this thread.
+        self._write_lock = threading.Lock()
 
     def run(self):
         while True:
-            message, condition = self._queue.get()
-            condition.acquire()
-            send_message(self._request, message)
-            condition.notify()
-            condition.release()
+            message = self._queue.get()
+            self._write_lock.acquire()
+            try:
+                send_message(self._request, message)
+            finally:
+                self._write_lock.release()
+            self._lock.acquire()
+            try:
+                self._pending -= 1
+                if self._pending == 0:
+                    self._idle.notifyAll()
+            finally:
+                self._lock.release()
 
     def send(self, message):
         """Send a message, blocking."""
 
-        condition = threading.Condition()
-        condition.acquire()
-        self._queue.put((message, condition))
-        condition.wait()
+        self._lock.acquire()
+        try:
+            # Let the messages queued by send_nowait go out first.
+            while self._pending > 0:
+                self._idle.wait()
+        finally:
+            self._lock.release()
+
+        self._write_lock.acquire()
+        try:
+            send_message(self._request, message)
+        finally:
+            self._write_lock.release()
 
     def send_nowait(self, message):
         """Send a message, non-blocking."""
 
-        self._queue.put((message, threading.Condition()))
+        self._lock.acquire()
+        try:
+            if not self._thread_started:
+                self.start()
+                self._thread_started = True
+            self._pending += 1
+            self._queue.put(message)
+        finally:
+            self._lock.release()
 
 
 # vi:sts=4 sw=4 et
@@ -38,9 +38,8 @@ http://tools.ietf.org/html/draft-ietf-hybi-websocket-multiplexing-06
 import collections
 import copy
 import email
-import email.parser
+import email.message
 import logging
-import math
 import struct
 import threading
 import traceback
@@ -83,6 +82,11 @@ _HTTP_BAD_RESPONSE_MESSAGES = {
     common.HTTP_STATUS_BAD_REQUEST: 'Bad Request',
 }
 
+# Encoded handshakes of AddChannelResponses for the statuses above.
+_HTTP_BAD_RESPONSES = dict(
+    [(status, 'HTTP/1.1 %d %s\r\n\r\n' % (status, message))
+     for status, message in _HTTP_BAD_RESPONSE_MESSAGES.iteritems()])
+
 # DropChannel reason code
 # TODO(bashi): Define all reason code defined in -05 draft.
 _DROP_CODE_NORMAL_CLOSURE = 1000
@@ -99,6 +103,13 @@ _DROP_CODE_UNKNOWN_REQUEST_ENCODING = 3002
 _DROP_CODE_SEND_QUOTA_VIOLATION = 3005
 _DROP_CODE_ACKNOWLEDGED = 3008
 
+# Precompiled formats for the multi-byte fields _MuxFramePayloadParser reads
+# and _encode_channel_id writes.
+_UINT16_STRUCT = struct.Struct('!H')
+_UINT8_UINT16_STRUCT = struct.Struct('!BH')
+_UINT32_STRUCT = struct.Struct('!L')
+_UINT64_STRUCT = struct.Struct('!Q')
+
 
 class MuxUnexpectedException(Exception):
     """Exception in handling multiplexing extension."""
@@ -136,23 +147,31 @@ class LogicalChannelError(Exception):
         self.message = message
 
 
+# Encodings of the channel ids that fit in one byte, the common case.
+_ONE_BYTE_CHANNEL_IDS = tuple([chr(i) for i in range(2 ** 7)])
+
+
 def _encode_channel_id(channel_id):
+    if 0 <= channel_id < 2 ** 7:
+        return _ONE_BYTE_CHANNEL_IDS[channel_id]
     if channel_id < 0:
         raise ValueError('Channel id %d must not be negative' % channel_id)
 
-    if channel_id < 2 ** 7:
-        return chr(channel_id)
     if channel_id < 2 ** 14:
-        return struct.pack('!H', 0x8000 + channel_id)
+        return _UINT16_STRUCT.pack(0x8000 + channel_id)
     if channel_id < 2 ** 21:
-        first = chr(0xc0 + (channel_id >> 16))
-        return first + struct.pack('!H', channel_id & 0xffff)
+        return _UINT8_UINT16_STRUCT.pack(0xc0 + (channel_id >> 16),
+                                         channel_id & 0xffff)
     if channel_id < 2 ** 29:
-        return struct.pack('!L', 0xe0000000 + channel_id)
+        return _UINT32_STRUCT.pack(0xe0000000 + channel_id)
 
     raise ValueError('Channel id %d is too large' % channel_id)
 
 
+# Every control block is sent on the control channel. Encode its id once.
+_ENCODED_CONTROL_CHANNEL_ID = _encode_channel_id(_CONTROL_CHANNEL_ID)
+
+
 def _encode_number(number):
     return create_length_header(number, False)
 
@@ -165,11 +184,11 @@ def _create_add_channel_response(channel_id, encoded_handshake,
 
     first_byte = ((_MUX_OPCODE_ADD_CHANNEL_RESPONSE << 5) |
                   (rejected << 4) | encoding)
-    block = (chr(first_byte) +
-             _encode_channel_id(channel_id) +
-             _encode_number(len(encoded_handshake)) +
-             encoded_handshake)
-    payload = _encode_channel_id(_CONTROL_CHANNEL_ID) + block
+    payload = ''.join([_ENCODED_CONTROL_CHANNEL_ID,
+                       chr(first_byte),
+                       _encode_channel_id(channel_id),
+                       _encode_number(len(encoded_handshake)),
+                       encoded_handshake])
     return create_binary_frame(payload, mask=outer_frame_mask)
 
 
@@ -179,25 +198,26 @@ def _create_drop_channel(channel_id, code=None, message='',
         raise ValueError('Code must be specified if message is specified')
 
     first_byte = _MUX_OPCODE_DROP_CHANNEL << 5
-    block = chr(first_byte) + _encode_channel_id(channel_id)
+    parts = [_ENCODED_CONTROL_CHANNEL_ID,
+             chr(first_byte),
+             _encode_channel_id(channel_id)]
     if code is None:
-        block += _encode_number(0) # Reason size
+        parts.append(_encode_number(0)) # Reason size
     else:
-        reason = struct.pack('!H', code) + message
-        reason_size = _encode_number(len(reason))
-        block += reason_size + reason
+        parts.append(_encode_number(len(message) + 2))
+        parts.append(_UINT16_STRUCT.pack(code))
+        parts.append(message)
 
-    payload = _encode_channel_id(_CONTROL_CHANNEL_ID) + block
-    return create_binary_frame(payload, mask=outer_frame_mask)
+    return create_binary_frame(''.join(parts), mask=outer_frame_mask)
 
 
 def _create_flow_control(channel_id, replenished_quota,
                          outer_frame_mask=False):
     first_byte = _MUX_OPCODE_FLOW_CONTROL << 5
-    block = (chr(first_byte) +
-             _encode_channel_id(channel_id) +
-             _encode_number(replenished_quota))
-    payload = _encode_channel_id(_CONTROL_CHANNEL_ID) + block
+    payload = ''.join([_ENCODED_CONTROL_CHANNEL_ID,
+                       chr(first_byte),
+                       _encode_channel_id(channel_id),
+                       _encode_number(replenished_quota)])
     return create_binary_frame(payload, mask=outer_frame_mask)
 
 
@@ -205,17 +225,19 @@ def _create_new_channel_slot(slots, send_quota, outer_frame_mask=False):
     if slots < 0 or send_quota < 0:
         raise ValueError('slots and send_quota must be non-negative.')
     first_byte = _MUX_OPCODE_NEW_CHANNEL_SLOT << 5
-    block = (chr(first_byte) +
-             _encode_number(slots) +
-             _encode_number(send_quota))
-    payload = _encode_channel_id(_CONTROL_CHANNEL_ID) + block
+    payload = ''.join([_ENCODED_CONTROL_CHANNEL_ID,
+                       chr(first_byte),
+                       _encode_number(slots),
+                       _encode_number(send_quota)])
     return create_binary_frame(payload, mask=outer_frame_mask)
 
 
 def _create_fallback_new_channel_slot(outer_frame_mask=False):
     first_byte = (_MUX_OPCODE_NEW_CHANNEL_SLOT << 5) | 1 # Set the F flag
-    block = (chr(first_byte) + _encode_number(0) + _encode_number(0))
-    payload = _encode_channel_id(_CONTROL_CHANNEL_ID) + block
+    payload = ''.join([_ENCODED_CONTROL_CHANNEL_ID,
+                       chr(first_byte),
+                       _encode_number(0),
+                       _encode_number(0)])
     return create_binary_frame(payload, mask=outer_frame_mask)
 
 
@@ -229,10 +251,18 @@ def _parse_request_text(request_text):
     if version != 'HTTP/1.1':
         raise ValueError('Bad request version %r' % version)
 
-    # email.parser.Parser() parses RFC 2822 (RFC 822) style headers.
     # RFC 6455 refers RFC 2616 for handshake parsing, and RFC 2616 refers
-    # RFC 822.
-    headers = email.parser.Parser().parsestr(header_lines)
+    # RFC 822. Handshakes don't use RFC 822 line folding, so split the header
+    # lines at the first colon instead of running the general
+    # email.parser.Parser(). The result is still an email.message.Message so
+    # that header lookups stay case-insensitive. Parsing stops at the first
+    # line that is not a header, e.g. the empty line ending the headers.
+    headers = email.message.Message()
+    for line in header_lines.split('\r\n'):
+        name, colon, value = line.partition(':')
+        if not colon or not name or '\r' in line or '\n' in line:
+            break
+        headers[name] = value.lstrip(' \t')
     return command, path, version, headers
 
 
@@ -243,6 +273,13 @@ class _ControlBlock(object):
     AddChannelResponse)
     """
 
+    # One control block is built for every block a client sends, so do
+    # without a per-instance __dict__. Only the attributes set for the
+    # block's opcode are assigned.
+    __slots__ = ('opcode', 'channel_id', 'encoding', 'encoded_handshake',
+                 'accepted', 'send_quota', 'drop_code', 'drop_message',
+                 'fallback', 'slots')
+
     def __init__(self, opcode):
         self.opcode = opcode
 
@@ -251,9 +288,17 @@ class _MuxFramePayloadParser(object):
     """A class that parses multiplexed frame payload."""
 
     def __init__(self, payload):
+        self._logger = util.get_class_logger(self)
+        self.reset(payload)
+
+    def reset(self, payload):
+        """Starts parsing a new payload, so that one parser can be reused
+        for successive frames.
+        """
+
         self._data = payload
+        self._data_length = len(payload)
         self._read_position = 0
-        self._logger = util.get_class_logger(self)
 
     def read_channel_id(self):
         """Reads channel id.
@@ -263,30 +308,38 @@ class _MuxFramePayloadParser(object):
                 valid channel id.
         """
 
-        remaining_length = len(self._data) - self._read_position
+        # Use temporary local variables to eliminate the cost to access
+        # attributes and builtins.
+        data = self._data
+        _ord = ord
+        remaining_length = self._data_length - self._read_position
         pos = self._read_position
         if remaining_length == 0:
             raise ValueError('Invalid channel id format')
 
-        channel_id = ord(self._data[pos])
-        channel_id_length = 1
+        channel_id = _ord(data[pos])
+        if channel_id & 0x80 == 0:
+            # Fast path for the 1-byte encoding used by most channels.
+            self._read_position = pos + 1
+            return channel_id
+
         if channel_id & 0xe0 == 0xe0:
             if remaining_length < 4:
                 raise ValueError('Invalid channel id format')
-            channel_id = struct.unpack('!L',
-                                       self._data[pos:pos+4])[0] & 0x1fffffff
+            channel_id = _UINT32_STRUCT.unpack_from(data, pos)[0] & 0x1fffffff
             channel_id_length = 4
         elif channel_id & 0xc0 == 0xc0:
             if remaining_length < 3:
                 raise ValueError('Invalid channel id format')
-            channel_id = (((channel_id & 0x1f) << 16) +
-                          struct.unpack('!H', self._data[pos+1:pos+3])[0])
+            channel_id = (((channel_id & 0x1f) << 16) |
+                          (_ord(data[pos+1]) << 8) |
+                          _ord(data[pos+2]))
             channel_id_length = 3
-        elif channel_id & 0x80 == 0x80:
+        else:
             if remaining_length < 2:
                 raise ValueError('Invalid channel id format')
-            channel_id = struct.unpack('!H',
-                                       self._data[pos:pos+2])[0] & 0x3fff
+            channel_id = (((channel_id & 0x3f) << 8) |
+                          _ord(data[pos+1]))
             channel_id_length = 2
         self._read_position += channel_id_length
 
@@ -299,7 +352,7 @@ class _MuxFramePayloadParser(object):
             PhysicalConnectionError: when the inner frame is invalid.
         """
 
-        if len(self._data) == self._read_position:
+        if self._data_length == self._read_position:
             raise PhysicalConnectionError(
                 _DROP_CODE_ENCAPSULATED_FRAME_IS_TRUNCATED)
 
@@ -313,30 +366,37 @@ class _MuxFramePayloadParser(object):
         payload = self.remaining_data()
         # Consume rest of the message which is payload data of the original
         # frame.
-        self._read_position = len(self._data)
+        self._read_position = self._data_length
         return fin, rsv1, rsv2, rsv3, opcode, payload
 
     def _read_number(self):
-        if self._read_position + 1 > len(self._data):
+        if self._read_position + 1 > self._data_length:
             raise PhysicalConnectionError(
                 _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
                 'Cannot read the first byte of number field')
 
-        number = ord(self._data[self._read_position])
+        # Use temporary local variables to eliminate the cost to access
+        # attributes and builtins.
+        data = self._data
+        _ord = ord
+        number = _ord(data[self._read_position])
         if number & 0x80 == 0x80:
             raise PhysicalConnectionError(
                 _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
                 'The most significant bit of the first byte of number should '
                 'be unset')
         self._read_position += 1
+        if number < 126:
+            # Fast path for the 1 byte encoding, used for most numbers.
+            return number
         pos = self._read_position
         if number == 127:
-            if pos + 8 > len(self._data):
+            if pos + 8 > self._data_length:
                 raise PhysicalConnectionError(
                     _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
                     'Invalid number field')
             self._read_position += 8
-            number = struct.unpack('!Q', self._data[pos:pos+8])[0]
+            number = _UINT64_STRUCT.unpack_from(data, pos)[0]
             if number > 0x7FFFFFFFFFFFFFFF:
                 raise PhysicalConnectionError(
                     _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
@@ -346,17 +406,17 @@ class _MuxFramePayloadParser(object):
                     _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
                     '%d should not be encoded by 9 bytes encoding' % number)
             return number
-        if number == 126:
-            if pos + 2 > len(self._data):
-                raise PhysicalConnectionError(
-                    _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
-                    'Invalid number field')
-            self._read_position += 2
-            number = struct.unpack('!H', self._data[pos:pos+2])[0]
-            if number <= 125:
-                raise PhysicalConnectionError(
-                    _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
-                    '%d should not be encoded by 3 bytes encoding' % number)
+        # number == 126
+        if pos + 2 > self._data_length:
+            raise PhysicalConnectionError(
+                _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
+                'Invalid number field')
+        self._read_position += 2
+        number = (_ord(data[pos]) << 8) | _ord(data[pos+1])
+        if number <= 125:
+            raise PhysicalConnectionError(
+                _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
+                '%d should not be encoded by 3 bytes encoding' % number)
         return number
 
     def _read_size_and_contents(self):
@@ -368,7 +428,7 @@ class _MuxFramePayloadParser(object):
 
         size = self._read_number()
         pos = self._read_position
-        if pos + size > len(self._data):
+        if pos + size > self._data_length:
             raise PhysicalConnectionError(
                 _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
                 'Cannot read %d bytes data' % size)
@@ -440,7 +500,7 @@ class _MuxFramePayloadParser(object):
             control_block.drop_code = None
             control_block.drop_message = ''
         elif len(reason) >= 2:
-            control_block.drop_code = struct.unpack('!H', reason[:2])[0]
+            control_block.drop_code = (ord(reason[0]) << 8) | ord(reason[1])
             control_block.drop_message = reason[2:]
         else:
             raise PhysicalConnectionError(
@@ -459,6 +519,16 @@ class _MuxFramePayloadParser(object):
         control_block.send_quota = self._read_number()
         return control_block
 
+    # The reader of each of the 8 possible control block opcodes, None for the
+    # opcodes not defined.
+    _CONTROL_BLOCK_READERS = (
+        _read_add_channel_request,  # _MUX_OPCODE_ADD_CHANNEL_REQUEST
+        _read_add_channel_response,  # _MUX_OPCODE_ADD_CHANNEL_RESPONSE
+        _read_flow_control,  # _MUX_OPCODE_FLOW_CONTROL
+        _read_drop_channel,  # _MUX_OPCODE_DROP_CHANNEL
+        _read_new_channel_slot,  # _MUX_OPCODE_NEW_CHANNEL_SLOT
+        None, None, None)
+
     def read_control_blocks(self):
         """Reads control block(s).
 
@@ -468,28 +538,21 @@ class _MuxFramePayloadParser(object):
            StopIteration: when no control blocks left.
         """
 
-        while self._read_position < len(self._data):
-            first_byte = ord(self._data[self._read_position])
+        data = self._data
+        _ord = ord
+        readers = self._CONTROL_BLOCK_READERS
+        while self._read_position < self._data_length:
+            first_byte = _ord(data[self._read_position])
             self._read_position += 1
             opcode = (first_byte >> 5) & 0x7
-            control_block = _ControlBlock(opcode=opcode)
-            if opcode == _MUX_OPCODE_ADD_CHANNEL_REQUEST:
-                yield self._read_add_channel_request(first_byte, control_block)
-            elif opcode == _MUX_OPCODE_ADD_CHANNEL_RESPONSE:
-                yield self._read_add_channel_response(
-                    first_byte, control_block)
-            elif opcode == _MUX_OPCODE_FLOW_CONTROL:
-                yield self._read_flow_control(first_byte, control_block)
-            elif opcode == _MUX_OPCODE_DROP_CHANNEL:
-                yield self._read_drop_channel(first_byte, control_block)
-            elif opcode == _MUX_OPCODE_NEW_CHANNEL_SLOT:
-                yield self._read_new_channel_slot(first_byte, control_block)
-            else:
+            reader = readers[opcode]
+            if reader is None:
                 raise PhysicalConnectionError(
                     _DROP_CODE_UNKNOWN_MUX_OPCODE,
                     'Invalid opcode %d' % opcode)
+            yield reader(self, first_byte, _ControlBlock(opcode=opcode))
 
-        assert self._read_position == len(self._data)
+        assert self._read_position == self._data_length
         raise StopIteration
 
     def remaining_data(self):
@@ -548,10 +611,16 @@ class _LogicalConnection(object):
 
         self._mux_handler = mux_handler
         self._channel_id = channel_id
-        self._incoming_data = ''
-        self._write_condition = threading.Condition()
+        # Incoming frame data not read yet, kept as received so that append
+        # and read don't copy the whole buffer.
+        self._incoming_chunks = collections.deque()
+        self._incoming_length = 0
+        # Neither condition is acquired again by the thread holding it, so
+        # back them with plain Locks instead of the default RLock, which is
+        # implemented in Python on Python 2.
+        self._write_condition = threading.Condition(threading.Lock())
         self._waiting_write_completion = False
-        self._read_condition = threading.Condition()
+        self._read_condition = threading.Condition(threading.Lock())
         self._read_state = self.STATE_ACTIVE
 
     def get_local_addr(self):
@@ -621,16 +690,23 @@ class _LogicalConnection(object):
         finally:
             self._write_condition.release()
 
-    def append_frame_data(self, frame_data):
-        """Appends incoming frame data. Called when mux_handler dispatches
-        frame data to the corresponding application.
+    def append_frame(self, header, payload):
+        """Appends an incoming frame given as its header and payload. Called
+        when mux_handler dispatches a frame to the corresponding application.
+        The two are queued as separate chunks so that the payload is never
+        copied into a combined string.
 
         Args:
-            frame_data: incoming frame data.
+            header: header of the incoming frame.
+            payload: payload of the incoming frame.
         """
 
         self._read_condition.acquire()
-        self._incoming_data += frame_data
+        self._incoming_chunks.append(header)
+        self._incoming_length += len(header)
+        if payload:
+            self._incoming_chunks.append(payload)
+            self._incoming_length += len(payload)
         self._read_condition.notify()
         self._read_condition.release()
 
@@ -649,7 +725,7 @@ class _LogicalConnection(object):
 
         self._read_condition.acquire()
         while (self._read_state == self.STATE_ACTIVE and
-               len(self._incoming_data) < length):
+               self._incoming_length < length):
             self._read_condition.wait()
 
         try:
@@ -661,8 +737,18 @@ class _LogicalConnection(object):
                     'Receiving %d byte failed. Logical channel (%d) closed' %
                     (length, self._channel_id))
 
-            value = self._incoming_data[:length]
-            self._incoming_data = self._incoming_data[length:]
+            chunks = self._incoming_chunks
+            parts = []
+            remaining = length
+            while remaining > 0:
+                chunk = chunks.popleft()
+                if len(chunk) > remaining:
+                    chunks.appendleft(chunk[remaining:])
+                    chunk = chunk[:remaining]
+                parts.append(chunk)
+                remaining -= len(chunk)
+            self._incoming_length -= length
+            value = ''.join(parts)
         finally:
             self._read_condition.release()
 
@@ -707,6 +793,10 @@ class _LogicalStream(Stream):
         # Control frames can be fragmented on logical channel.
         stream_options.allow_fragmented_control_frame = True
         Stream.__init__(self, request, stream_options)
+        # The channel id of a logical channel never changes. Encode it once,
+        # and keep it joined with each inner frame first byte used so far.
+        self._encoded_channel_id = _encode_channel_id(request.channel_id)
+        self._inner_frame_prefixes = {}
         self._send_quota = send_quota
         self._send_quota_condition = threading.Condition()
         self._receive_quota = receive_quota
@@ -715,8 +805,11 @@ class _LogicalStream(Stream):
     def _create_inner_frame(self, opcode, payload, end=True):
         # TODO(bashi): Support extensions that use reserved bits.
         first_byte = (end << 7) | opcode
-        return (_encode_channel_id(self._request.channel_id) +
-                chr(first_byte) + payload)
+        prefix = self._inner_frame_prefixes.get(first_byte)
+        if prefix is None:
+            prefix = self._encoded_channel_id + chr(first_byte)
+            self._inner_frame_prefixes[first_byte] = prefix
+        return prefix + payload
 
     def _write_inner_frame(self, opcode, payload, end=True):
         payload_length = len(payload)
@@ -746,7 +839,7 @@ class _LogicalStream(Stream):
                     self._send_quota_condition.acquire()
                     while self._send_quota == 0:
                         self._logger.debug(
-                            'No quota. Waiting FlowControl message for %d.' %
+                            'No quota. Waiting FlowControl message for %d.',
                             self._request.channel_id)
                         self._send_quota_condition.wait()
 
@@ -763,14 +856,14 @@ class _LogicalStream(Stream):
                     frame_data = self._writer.build(
                         inner_frame, end=True, binary=True)
                     self._send_quota -= write_length
-                    self._logger.debug('Consumed quota=%d, remaining=%d' %
-                                       (write_length, self._send_quota))
+                    self._logger.debug('Consumed quota=%d, remaining=%d',
+                                       write_length, self._send_quota)
                 finally:
                     self._send_quota_condition.release()
 
                 # Writing data will block the worker so we need to release
                 # _send_quota_condition before writing.
-                self._logger.debug('Sending inner frame: %r' % frame_data)
+                self._logger.debug('Sending inner frame: %r', frame_data)
                 self._request.connection.write(frame_data)
                 write_position += write_length
 
@@ -786,8 +879,8 @@ class _LogicalStream(Stream):
 
         self._send_quota_condition.acquire()
         self._send_quota += send_quota
-        self._logger.debug('Replenished send quota for channel id %d: %d' %
-                           (self._request.channel_id, self._send_quota))
+        self._logger.debug('Replenished send quota for channel id %d: %d',
+                           self._request.channel_id, self._send_quota)
         self._send_quota_condition.notify()
         self._send_quota_condition.release()
 
@@ -795,9 +888,9 @@ class _LogicalStream(Stream):
         """Consumes receive quota. Returns False on failure."""
 
         if self._receive_quota < amount:
-            self._logger.debug('Violate quota on channel id %d: %d < %d' %
-                               (self._request.channel_id,
-                                self._receive_quota, amount))
+            self._logger.debug('Violate quota on channel id %d: %d < %d',
+                               self._request.channel_id,
+                               self._receive_quota, amount)
             return False
         self._receive_quota -= amount
         return True
@@ -817,7 +910,11 @@ class _LogicalStream(Stream):
             opcode = common.OPCODE_BINARY
         else:
             opcode = common.OPCODE_TEXT
-            message = message.encode('utf-8')
+            if isinstance(message, unicode):
+                message = message.encode('utf-8')
+            else:
+                # Accept ASCII str as str.encode would, without re-encoding it.
+                message.decode('ascii')
 
         self._write_inner_frame(opcode, message, end)
 
@@ -838,8 +935,8 @@ class _LogicalStream(Stream):
         self._receive_quota += amount
         frame_data = _create_flow_control(self._request.channel_id,
                                           amount)
-        self._logger.debug('Sending flow control for %d, replenished=%d' %
-                           (self._request.channel_id, amount))
+        self._logger.debug('Sending flow control for %d, replenished=%d',
+                           self._request.channel_id, amount)
         self._request.connection.write_control_data(frame_data)
         return opcode, payload, fin, rsv1, rsv2, rsv3
 
@@ -859,8 +956,8 @@ class _LogicalStream(Stream):
         """Overrides Stream._send_closing_handshake."""
 
         body = create_closing_handshake_body(code, reason)
-        self._logger.debug('Sending closing handshake for %d: (%r, %r)' %
-                           (self._request.channel_id, code, reason))
+        self._logger.debug('Sending closing handshake for %d: (%r, %r)',
+                           self._request.channel_id, code, reason)
         self._write_inner_frame(common.OPCODE_CLOSE, body, end=True)
 
         self._request.server_terminated = True
@@ -868,8 +965,8 @@ class _LogicalStream(Stream):
     def send_ping(self, body=''):
         """Overrides Stream.send_ping"""
 
-        self._logger.debug('Sending ping on logical channel %d: %r' %
-                           (self._request.channel_id, body))
+        self._logger.debug('Sending ping on logical channel %d: %r',
+                           self._request.channel_id, body)
         self._write_inner_frame(common.OPCODE_PING, body, end=True)
 
         self._ping_queue.append(body)
@@ -877,15 +974,15 @@ class _LogicalStream(Stream):
     def _send_pong(self, body):
         """Overrides Stream._send_pong"""
 
-        self._logger.debug('Sending pong on logical channel %d: %r' %
-                           (self._request.channel_id, body))
+        self._logger.debug('Sending pong on logical channel %d: %r',
+                           self._request.channel_id, body)
         self._write_inner_frame(common.OPCODE_PONG, body, end=True)
 
     def close_connection(self, code=common.STATUS_NORMAL_CLOSURE, reason=''):
         """Overrides Stream.close_connection."""
 
         # TODO(bashi): Implement
-        self._logger.debug('Closing logical connection %d' %
+        self._logger.debug('Closing logical connection %d',
                            self._request.channel_id)
         self._request.server_terminated = True
 
@@ -902,6 +999,9 @@ class _OutgoingData(object):
     origin of the data.
     """
 
+    # One instance is created for every outgoing frame.
+    __slots__ = ('channel_id', 'data')
+
     def __init__(self, channel_id, data):
         self.channel_id = channel_id
         self.data = data
@@ -927,7 +1027,10 @@ class _PhysicalConnectionWriter(threading.Thread):
         self.setDaemon(True)
         self._stop_requested = False
         self._deque = collections.deque()
-        self._deque_condition = threading.Condition()
+        # Every outgoing frame goes through this condition and it is never
+        # acquired recursively, so back it with a plain Lock. See
+        # _LogicalConnection.__init__().
+        self._deque_condition = threading.Condition(threading.Lock())
 
     def put_outgoing_data(self, data):
         """Puts outgoing data.
@@ -950,9 +1053,15 @@ class _PhysicalConnectionWriter(threading.Thread):
         finally:
             self._deque_condition.release()
 
-    def _write_data(self, outgoing_data):
+    def _write_data(self, outgoing_data_list):
+        """Writes the data of all the given _OutgoingData instances with one
+        write call.
+        """
+
         try:
-            self._mux_handler.physical_connection.write(outgoing_data.data)
+            self._mux_handler.physical_connection.write(
+                ''.join([outgoing_data.data
+                         for outgoing_data in outgoing_data_list]))
         except Exception, e:
             util.prepend_message_to_exception(
                 'Failed to send message to %r: ' %
@@ -961,8 +1070,16 @@ class _PhysicalConnectionWriter(threading.Thread):
 
         # TODO(bashi): It would be better to block the thread that sends
         # control data as well.
-        if outgoing_data.channel_id != _CONTROL_CHANNEL_ID:
-            self._mux_handler.notify_write_done(outgoing_data.channel_id)
+        channel_ids = [outgoing_data.channel_id
+                       for outgoing_data in outgoing_data_list
+                       if outgoing_data.channel_id != _CONTROL_CHANNEL_ID]
+        if channel_ids:
+            self._mux_handler.notify_write_done(channel_ids)
+
+    def _pop_all(self):
+        outgoing_data_list = list(self._deque)
+        self._deque.clear()
+        return outgoing_data_list
 
     def run(self):
         self._deque_condition.acquire()
@@ -971,16 +1088,16 @@ class _PhysicalConnectionWriter(threading.Thread):
                 self._deque_condition.wait()
                 continue
 
-            outgoing_data = self._deque.popleft()
+            # Write everything queued so far at once.
+            outgoing_data_list = self._pop_all()
             self._deque_condition.release()
-            self._write_data(outgoing_data)
+            self._write_data(outgoing_data_list)
             self._deque_condition.acquire()
 
         # Flush deque
         try:
-            while len(self._deque) > 0:
-                outgoing_data = self._deque.popleft()
-                self._write_data(outgoing_data)
+            if len(self._deque) > 0:
+                self._write_data(self._pop_all())
         finally:
             self._deque_condition.release()
 
@@ -1064,7 +1181,7 @@ class _Worker(threading.Thread):
         self.setDaemon(True)
 
     def run(self):
-        self._logger.debug('Logical channel worker started. (id=%d)' %
+        self._logger.debug('Logical channel worker started. (id=%d)',
                            self._request.channel_id)
         try:
             # Non-critical exceptions will be handled by dispatcher.
@@ -1107,7 +1224,7 @@ class _MuxHandshaker(hybi.Handshaker):
     def _create_stream(self, stream_options):
         """Override hybi.Handshaker._create_stream."""
 
-        self._logger.debug('Creating logical stream for %d' %
+        self._logger.debug('Creating logical stream for %d',
                            self._request.channel_id)
         return _LogicalStream(self._request, self._send_quota,
                               self._receive_quota)
@@ -1144,8 +1261,8 @@ class _MuxHandshaker(hybi.Handshaker):
         frame_data = _create_add_channel_response(
                          self._request.channel_id,
                          handshake_response)
-        self._logger.debug('Sending handshake response for %d: %r' %
-                           (self._request.channel_id, frame_data))
+        self._logger.debug('Sending handshake response for %d: %r',
+                           self._request.channel_id, frame_data)
         self._request.connection.write_control_data(frame_data)
 
 
@@ -1294,7 +1411,7 @@ class _MuxHandler(object):
         self._logical_channels_condition.acquire()
         try:
             while len(self._logical_channels) > 0:
-                self._logger.debug('Waiting workers(%d)...' %
+                self._logger.debug('Waiting workers(%d)...',
                                    len(self._logical_channels))
                 self._worker_done_notify_received = False
                 self._logical_channels_condition.wait(timeout)
@@ -1311,23 +1428,26 @@ class _MuxHandler(object):
 
         return True
 
-    def notify_write_done(self, channel_id):
-        """Called by the writer thread when a write operation has done.
+    def notify_write_done(self, channel_ids):
+        """Called by the writer thread when write operations have done.
 
         Args:
-            channel_id: objective channel id.
+            channel_ids: list of objective channel ids, one entry per
+                completed write.
         """
 
-        try:
-            self._logical_channels_condition.acquire()
-            if channel_id in self._logical_channels:
-                channel_data = self._logical_channels[channel_id]
+        # _logical_channels is only mutated under
+        # _logical_channels_condition, and a single dict lookup is atomic,
+        # so the lock is not taken here. A channel removed right after the
+        # lookup only gets a write completion nobody waits for anymore.
+        logical_channels = self._logical_channels
+        for channel_id in channel_ids:
+            channel_data = logical_channels.get(channel_id)
+            if channel_data is not None:
                 channel_data.request.connection.notify_write_done()
             else:
-                self._logger.debug('Seems that logical channel for %d has gone'
-                                   % channel_id)
-        finally:
-            self._logical_channels_condition.release()
+                self._logger.debug(
+                    'Seems that logical channel for %d has gone', channel_id)
 
     def send_control_data(self, data):
         """Sends data via the control channel.
@@ -1354,20 +1474,18 @@ class _MuxHandler(object):
     def _send_drop_channel(self, channel_id, code=None, message=''):
         frame_data = _create_drop_channel(channel_id, code, message)
         self._logger.debug(
-            'Sending drop channel for channel id %d' % channel_id)
+            'Sending drop channel for channel id %d', channel_id)
         self.send_control_data(frame_data)
 
     def _send_error_add_channel_response(self, channel_id, status=None):
         if status is None:
             status = common.HTTP_STATUS_BAD_REQUEST
 
-        if status in _HTTP_BAD_RESPONSE_MESSAGES:
-            message = _HTTP_BAD_RESPONSE_MESSAGES[status]
-        else:
-            self._logger.debug('Response message for %d is not found' % status)
-            message = '???'
+        response = _HTTP_BAD_RESPONSES.get(status)
+        if response is None:
+            self._logger.debug('Response message for %d is not found', status)
+            response = 'HTTP/1.1 %d ???\r\n\r\n' % status
 
-        response = 'HTTP/1.1 %d %s\r\n\r\n' % (status, message)
         frame_data = _create_add_channel_response(channel_id,
                                                   encoded_handshake=response,
                                                   encoding=0, rejected=True)
@@ -1429,7 +1547,7 @@ class _MuxHandler(object):
         try:
             self._logical_channels_condition.acquire()
             if logical_request.channel_id in self._logical_channels:
-                self._logger.debug('Channel id %d already exists' %
+                self._logger.debug('Channel id %d already exists',
                                    logical_request.channel_id)
                 raise PhysicalConnectionError(
                     _DROP_CODE_CHANNEL_ALREADY_EXISTS,
@@ -1446,7 +1564,7 @@ class _MuxHandler(object):
         try:
             logical_request = self._create_logical_request(block)
         except ValueError, e:
-            self._logger.debug('Failed to create logical request: %r' % e)
+            self._logger.debug('Failed to create logical request: %r', e)
             self._send_error_add_channel_response(
                 block.channel_id, status=common.HTTP_STATUS_BAD_REQUEST)
             return
@@ -1465,9 +1583,9 @@ class _MuxHandler(object):
     def _process_flow_control(self, block):
         try:
             self._logical_channels_condition.acquire()
-            if not block.channel_id in self._logical_channels:
+            channel_data = self._logical_channels.get(block.channel_id)
+            if channel_data is None:
                 return
-            channel_data = self._logical_channels[block.channel_id]
             channel_data.request.ws_stream.replenish_send_quota(
                 block.send_quota)
         finally:
@@ -1475,8 +1593,8 @@ class _MuxHandler(object):
 
     def _process_drop_channel(self, block):
         self._logger.debug(
-            'DropChannel received for %d: code=%r, reason=%r' %
-            (block.channel_id, block.drop_code, block.drop_message))
+            'DropChannel received for %d: code=%r, reason=%r',
+            block.channel_id, block.drop_code, block.drop_message)
         try:
             self._logical_channels_condition.acquire()
             if not block.channel_id in self._logical_channels:
@@ -1489,36 +1607,49 @@ class _MuxHandler(object):
         finally:
             self._logical_channels_condition.release()
 
+    def _process_add_channel_response(self, block):
+        raise PhysicalConnectionError(
+            _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
+            'Received AddChannelResponse')
+
+    def _process_new_channel_slot(self, block):
+        raise PhysicalConnectionError(
+            _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
+            'Received NewChannelSlot')
+
+    # The processor of each of the 8 possible control block opcodes, None for
+    # the opcodes not defined. See
+    # _MuxFramePayloadParser._CONTROL_BLOCK_READERS.
+    _CONTROL_BLOCK_PROCESSORS = (
+        _process_add_channel_request,  # _MUX_OPCODE_ADD_CHANNEL_REQUEST
+        _process_add_channel_response,  # _MUX_OPCODE_ADD_CHANNEL_RESPONSE
+        _process_flow_control,  # _MUX_OPCODE_FLOW_CONTROL
+        _process_drop_channel,  # _MUX_OPCODE_DROP_CHANNEL
+        _process_new_channel_slot,  # _MUX_OPCODE_NEW_CHANNEL_SLOT
+        None, None, None)
+
     def _process_control_blocks(self, parser):
+        processors = self._CONTROL_BLOCK_PROCESSORS
         for control_block in parser.read_control_blocks():
             opcode = control_block.opcode
-            self._logger.debug('control block received, opcode: %d' % opcode)
-            if opcode == _MUX_OPCODE_ADD_CHANNEL_REQUEST:
-                self._process_add_channel_request(control_block)
-            elif opcode == _MUX_OPCODE_ADD_CHANNEL_RESPONSE:
-                raise PhysicalConnectionError(
-                    _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
-                    'Received AddChannelResponse')
-            elif opcode == _MUX_OPCODE_FLOW_CONTROL:
-                self._process_flow_control(control_block)
-            elif opcode == _MUX_OPCODE_DROP_CHANNEL:
-                self._process_drop_channel(control_block)
-            elif opcode == _MUX_OPCODE_NEW_CHANNEL_SLOT:
-                raise PhysicalConnectionError(
-                    _DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
-                    'Received NewChannelSlot')
-            else:
+            self._logger.debug('control block received, opcode: %d', opcode)
+            processor = processors[opcode]
+            if processor is None:
                 raise MuxUnexpectedException(
                     'Unexpected opcode %r' % opcode)
+            processor(self, control_block)
 
     def _process_logical_frame(self, channel_id, parser):
-        self._logger.debug('Received a frame. channel id=%d' % channel_id)
+        self._logger.debug('Received a frame. channel id=%d', channel_id)
+        # Hold the lock until the frame is queued so that the channel can't
+        # be removed by notify_worker_done() meanwhile. Otherwise a quota
+        # violation on a removed channel would send a second DropChannel.
         try:
             self._logical_channels_condition.acquire()
-            if not channel_id in self._logical_channels:
+            channel_data = self._logical_channels.get(channel_id)
+            if channel_data is None:
                 # We must ignore the message for an inactive channel.
                 return
-            channel_data = self._logical_channels[channel_id]
             fin, rsv1, rsv2, rsv3, opcode, payload = parser.read_inner_frame()
             consuming_byte = len(payload)
             if opcode != common.OPCODE_CONTINUATION:
@@ -1528,10 +1659,9 @@ class _MuxHandler(object):
                 # The client violates quota. Close logical channel.
                 raise LogicalChannelError(
                     channel_id, _DROP_CODE_SEND_QUOTA_VIOLATION)
-            header = create_header(opcode, len(payload), fin, rsv1, rsv2, rsv3,
-                                   mask=False)
-            frame_data = header + payload
-            channel_data.request.connection.append_frame_data(frame_data)
+            header = create_header(opcode, len(payload), fin, rsv1, rsv2,
+                                   rsv3, mask=False)
+            channel_data.request.connection.append_frame(header, payload)
         finally:
             self._logical_channels_condition.release()
 
@@ -1564,7 +1694,7 @@ class _MuxHandler(object):
             channel_id: channel id corresponded with the worker.
         """
 
-        self._logger.debug('Worker for channel id %d terminated' % channel_id)
+        self._logger.debug('Worker for channel id %d terminated', channel_id)
         try:
             self._logical_channels_condition.acquire()
             if not channel_id in self._logical_channels:
@@ -1588,14 +1718,21 @@ class _MuxHandler(object):
 
         # Terminate all logical connections
         self._logger.debug('termiating all logical connections...')
+        # Take a snapshot of the channels and terminate them without holding
+        # the lock so that workers finishing meanwhile don't wait on it.
+        # The channels stay registered until their workers call
+        # notify_worker_done().
         self._logical_channels_condition.acquire()
-        for channel_data in self._logical_channels.values():
+        try:
+            channels = self._logical_channels.values()
+        finally:
+            self._logical_channels_condition.release()
+        for channel_data in channels:
             try:
                 channel_data.request.connection.set_read_state(
                     _LogicalConnection.STATE_TERMINATED)
             except Exception:
                 pass
-        self._logical_channels_condition.release()
 
     def fail_physical_connection(self, code, message):
         """Fail the physical connection.
@@ -1619,7 +1756,7 @@ class _MuxHandler(object):
             message: drop message.
         """
 
-        self._logger.debug('Failing logical channel %d...' % channel_id)
+        self._logger.debug('Failing logical channel %d...', channel_id)
         try:
             self._logical_channels_condition.acquire()
             if channel_id in self._logical_channels:
@@ -72,6 +72,14 @@ the text box next to the send button and click the send button. If everything
 is working, you'll see the message you typed echoed by the server.
 
 
+LISTENING ON A UNIX DOMAIN SOCKET
+
+To accept connections on a UNIX domain socket instead of TCP, run
+standalone.py with --unix-socket option. The port specified by -p is not
+listened to but is still used as the port of the server, e.g. to check the
+Host header.
+
+
 SUPPORTING TLS
 
 To support TLS, run standalone.py with -t, -k, and -c options.
@@ -136,6 +144,7 @@ import os
 import re
 import select
 import socket
+import stat
 import sys
 import threading
 import time
@@ -362,7 +371,11 @@ class WebSocketServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
     def _create_sockets(self):
         self.server_name, self.server_port = self.server_address
         self._sockets = []
-        if not self.server_name:
+        if self.websocket_server_options.unix_socket:
+            addrinfo_array = [
+                (socket.AF_UNIX, socket.SOCK_STREAM, 0, '',
+                 self.websocket_server_options.unix_socket)]
+        elif not self.server_name:
             # On platforms that doesn't support IPv6, the first bind fails.
             # On platforms that supports IPv6
             # - If it binds both IPv4 and IPv6 on call with AF_INET6, the
@@ -415,18 +428,25 @@ class WebSocketServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
 
         failed_sockets = []
 
+        unix_socket = self.websocket_server_options.unix_socket
+        if unix_socket:
+            self._remove_stale_unix_socket(unix_socket)
+
         for socketinfo in self._sockets:
             socket_, addrinfo = socketinfo
             self._logger.info('Bind on: %r', addrinfo)
             if self.allow_reuse_address:
                 socket_.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             try:
-                socket_.bind(self.server_address)
+                if unix_socket:
+                    socket_.bind(unix_socket)
+                else:
+                    socket_.bind(self.server_address)
             except Exception, e:
                 self._logger.info('Skip by failure: %r', e)
                 socket_.close()
                 failed_sockets.append(socketinfo)
-            if self.server_address[1] == 0:
+            if not unix_socket and self.server_address[1] == 0:
                 # The operating system assigns the actual port number for port
                 # number 0. This case, the second and later sockets should use
                 # the same port number. Also self.server_port is rewritten
@@ -439,6 +459,19 @@ class WebSocketServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
         for socketinfo in failed_sockets:
             self._sockets.remove(socketinfo)
 
+    def _remove_stale_unix_socket(self, path):
+        """Removes the UNIX domain socket file left by a server which exited
+        without closing it. Binding to an existing path fails.
+        """
+
+        try:
+            mode = os.stat(path).st_mode
+        except OSError:
+            return
+        if stat.S_ISSOCK(mode):
+            self._logger.info('Remove stale socket: %r', path)
+            os.remove(path)
+
     def server_activate(self):
         """Override SocketServer.TCPServer.server_activate to enable multiple
         sockets listen.
@@ -473,6 +506,10 @@ class WebSocketServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
             self._logger.info('Close on: %r', addrinfo)
             socket_.close()
 
+        if self.websocket_server_options.unix_socket:
+            self._remove_stale_unix_socket(
+                self.websocket_server_options.unix_socket)
+
     def fileno(self):
         """Override SocketServer.TCPServer.fileno."""
 
@@ -496,6 +533,10 @@ class WebSocketServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
         """
 
         accepted_socket, client_address = self.socket.accept()
+        if self.websocket_server_options.unix_socket:
+            # A peer of a UNIX domain socket has no address. Use a pair of
+            # host and port as for TCP since other code expects it.
+            client_address = ('', 0)
         if self.websocket_server_options.use_tls and _HAS_OPEN_SSL:
             accepted_socket = _StandaloneSSLConnection(accepted_socket)
         return accepted_socket, client_address
@@ -755,6 +796,11 @@ def _build_option_parser():
     parser.add_option('-p', '--port', dest='port', type='int',
                       default=common.DEFAULT_WEB_SOCKET_PORT,
                       help='port to listen to')
+    parser.add_option('--unix-socket', '--unix_socket', dest='unix_socket',
+                      default=None,
+                      help=('path of a UNIX domain socket to listen to '
+                            'instead of TCP. The port is still used to '
+                            'validate requests'))
     parser.add_option('-P', '--validation-port', '--validation_port',
                       dest='validation_port', type='int',
                       default=None,
@@ -963,6 +1009,11 @@ def _main(args=None):
                     'To use TLS, specify private_key and certificate.')
             sys.exit(1)
 
+    if options.unix_socket and not hasattr(socket, 'AF_UNIX'):
+        logging.critical('UNIX domain socket is not supported on this '
+                         'platform.')
+        sys.exit(1)
+
     if options.tls_client_auth:
         if not options.use_tls:
             logging.critical('TLS must be enabled for client authentication.')
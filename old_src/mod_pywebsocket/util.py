@@ -32,7 +32,7 @@
 """
 
 
-import array
+import binascii
 import errno
 
 # Import hash classes from a module available and recommended for each Python
@@ -145,9 +145,19 @@ def hexify(s):
     return ' '.join(map(lambda x: '%02x' % ord(x), s))
 
 
+# Loggers returned by get_class_logger, keyed by class. logging.getLogger
+# formats the name and takes the logging module's lock on every call, and
+# get_class_logger is called for each new stream, worker and channel.
+_class_loggers = {}
+
+
 def get_class_logger(o):
-    return logging.getLogger(
-        '%s.%s' % (o.__class__.__module__, o.__class__.__name__))
+    cls = o.__class__
+    logger = _class_loggers.get(cls)
+    if logger is None:
+        logger = logging.getLogger('%s.%s' % (cls.__module__, cls.__name__))
+        _class_loggers[cls] = logger
+    return logger
 
 
 class NoopMasker(object):
@@ -170,24 +180,28 @@ class RepeatedXorMasker(object):
     """
 
     def __init__(self, mask):
-        self._mask = map(ord, mask)
-        self._mask_size = len(self._mask)
+        self._mask = mask
+        self._mask_size = len(mask)
         self._count = 0
 
     def mask(self, s):
-        result = array.array('B')
-        result.fromstring(s)
-        # Use temporary local variables to eliminate the cost to access
-        # attributes
+        length = len(s)
+        if length == 0:
+            return ''
+
+        # XOR the whole string at once by treating it and the masking bytes
+        # repeated to the same length as big integers. This is much faster
+        # than XOR-ing one byte at a time in Python for all but the shortest
+        # strings.
         count = self._count
-        mask = self._mask
         mask_size = self._mask_size
-        for i in xrange(len(result)):
-            result[i] ^= mask[count]
-            count = (count + 1) % mask_size
-        self._count = count
+        rotated_mask = self._mask[count:] + self._mask[:count]
+        repeated_mask = (rotated_mask * (length // mask_size + 1))[:length]
+        masked = (int(binascii.hexlify(s), 16) ^
+                  int(binascii.hexlify(repeated_mask), 16))
+        self._count = (count + length) % mask_size
 
-        return result.tostring()
+        return binascii.unhexlify('%0*x' % (length * 2, masked))
 
 
 class DeflateRequest(object):
@@ -303,7 +303,6 @@ class WebSocketHandshake(object):
 
         request_line = _method_line(self._options.resource)
         self._logger.debug('Opening handshake Request-Line: %r', request_line)
-        self._socket.sendall(request_line)
 
         fields = []
         fields.append(_UPGRADE_HEADER)
@@ -334,9 +333,8 @@ class WebSocketHandshake(object):
 
         self._logger.debug('Opening handshake request headers: %r', fields)
 
-        for field in fields:
-            self._socket.sendall(field)
-        self._socket.sendall('\r\n')
+        # Send the whole request at once not to split it into many segments.
+        self._socket.sendall(''.join([request_line] + fields + ['\r\n']))
 
         self._logger.info('Sent opening handshake request')
 
@@ -489,10 +487,12 @@ class WebSocketHybi00Handshake(object):
 
         self._socket = socket
 
+        # The request is accumulated in /request/ and sent at once not to
+        # split it into many segments.
         # 4.1 5. send request line.
         request_line = _method_line(self._options.resource)
         self._logger.debug('Opening handshake Request-Line: %r', request_line)
-        self._socket.sendall(request_line)
+        request = [request_line]
         # 4.1 6. Let /fields/ be an empty list of strings.
         fields = []
         # 4.1 7. Add the string "Upgrade: WebSocket" to /fields/.
@@ -525,20 +525,21 @@ class WebSocketHybi00Handshake(object):
         random.shuffle(fields)
 
         self._logger.debug('Opening handshake request headers: %r', fields)
-        for field in fields:
-            self._socket.sendall(field)
+        request.extend(fields)
 
         # 4.1 25. send a UTF-8-encoded U+000D CARRIAGE RETURN U+000A LINE FEED
         # character pair (CRLF).
-        self._socket.sendall('\r\n')
+        request.append('\r\n')
         # 4.1 26. let /key3/ be a string consisting of eight random bytes (or
         # equivalently, a random 64 bit integer encoded in a big-endian order).
         self._key3 = self._generate_key3()
         # 4.1 27. send /key3/ to the server.
-        self._socket.sendall(self._key3)
+        request.append(self._key3)
         self._logger.debug(
             'Key3: %r (%s)', self._key3, util.hexify(self._key3))
 
+        self._socket.sendall(''.join(request))
+
         self._logger.info('Sent opening handshake request')
 
         # 4.1 28. Read bytes from the server until either the connection
@@ -721,7 +722,6 @@ class WebSocketHixie75Handshake(object):
 
         request_line = _method_line(self._options.resource)
         self._logger.debug('Opening handshake Request-Line: %r', request_line)
-        self._socket.sendall(request_line)
 
         headers = _UPGRADE_HEADER_HIXIE75 + _CONNECTION_HEADER
         headers += _format_host_header(
@@ -730,9 +730,8 @@ class WebSocketHixie75Handshake(object):
             self._options.use_tls)
         headers += _origin_header(self._options.origin)
         self._logger.debug('Opening handshake request headers: %r', headers)
-        self._socket.sendall(headers)
 
-        self._socket.sendall('\r\n')
+        self._socket.sendall(request_line + headers + '\r\n')
 
         self._logger.info('Sent opening handshake request')
 
@@ -980,7 +979,14 @@ class ClientOptions(object):
         self.origin = ''
         self.resource = ''
         self.server_port = -1
+        # If set, connects to this UNIX domain socket instead of
+        # server_host:server_port. server_host and server_port are still
+        # used for the Host header.
+        self.unix_socket = None
         self.socket_timeout = 1000
+        # Disable Nagle's algorithm so that small frames are sent without
+        # waiting for the ACK of the previous segment.
+        self.tcp_nodelay = True
         self.use_tls = False
         self.extensions = []
         # Enable deflate-stream.
@@ -1016,11 +1022,18 @@ class Client(object):
         self._stream_class = stream_class
 
     def connect(self):
-        self._socket = socket.socket()
+        if self._options.unix_socket:
+            self._socket = socket.socket(socket.AF_UNIX)
+            address = self._options.unix_socket
+        else:
+            self._socket = socket.socket()
+            if self._options.tcp_nodelay:
+                self._socket.setsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            address = (self._options.server_host, self._options.server_port)
         self._socket.settimeout(self._options.socket_timeout)
 
-        self._socket.connect((self._options.server_host,
-                              self._options.server_port))
+        self._socket.connect(address)
         if self._options.use_tls:
             self._socket = _TLSSocket(self._socket)
 
@@ -32,7 +32,7 @@
 """
 
 
-import Queue
+import collections
 import threading
 
 from mod_pywebsocket import common
@@ -113,24 +113,54 @@ class MockBlockingConn(_MockConnBase):
 
     def __init__(self):
         _MockConnBase.__init__(self)
-        self._queue = Queue.Queue()
+        # Chunks given to put_bytes are queued as they are. Bytes taken from
+        # the queue but not read yet are kept in _buffer.
+        self._chunks = collections.deque()
+        self._chunks_condition = threading.Condition()
+        self._buffer = ''
+        self._buffer_pos = 0
+
+    def _fill_buffer(self):
+        """Blocks until at least one byte is buffered."""
+
+        if self._buffer_pos < len(self._buffer):
+            return
+
+        self._chunks_condition.acquire()
+        try:
+            while not self._chunks:
+                self._chunks_condition.wait()
+            self._buffer = self._chunks.popleft()
+        finally:
+            self._chunks_condition.release()
+        self._buffer_pos = 0
 
     def readline(self):
         """Override mod_python.apache.mp_conn.readline."""
-        line = ''
+
+        chunks = []
         while True:
-            c = self._queue.get()
-            line += c
-            if c == '\n':
-                return line
+            self._fill_buffer()
+            end_index = self._buffer.find('\n', self._buffer_pos)
+            if end_index != -1:
+                end_index += 1
+                chunks.append(self._buffer[self._buffer_pos:end_index])
+                self._buffer_pos = end_index
+                return ''.join(chunks)
+            chunks.append(self._buffer[self._buffer_pos:])
+            self._buffer_pos = len(self._buffer)
 
     def read(self, length):
         """Override mod_python.apache.mp_conn.read."""
 
-        data = ''
-        for unused in range(length):
-            data += self._queue.get()
-        return data
+        chunks = []
+        while length > 0:
+            self._fill_buffer()
+            end_index = min(len(self._buffer), self._buffer_pos + length)
+            chunks.append(self._buffer[self._buffer_pos:end_index])
+            length -= end_index - self._buffer_pos
+            self._buffer_pos = end_index
+        return ''.join(chunks)
 
     def put_bytes(self, bytes):
         """Put bytes to be read from this mock.
@@ -139,8 +169,15 @@ class MockBlockingConn(_MockConnBase):
             bytes: bytes to be read.
         """
 
-        for byte in bytes:
-            self._queue.put(byte)
+        if not bytes:
+            return
+
+        self._chunks_condition.acquire()
+        try:
+            self._chunks.append(bytes)
+            self._chunks_condition.notify()
+        finally:
+            self._chunks_condition.release()
 
 
 class MockTable(dict):
@@ -52,6 +52,7 @@ import random
 import socket
 import struct
 import threading
+import time
 
 from mod_pywebsocket import util
 
@@ -452,9 +453,15 @@ class MuxClient(object):
         if opcode == client_for_testing.OPCODE_CLOSE:
             self._physical_connection_close_message = message
             if self._is_active:
-                self._stream.send_close(
-                    code=client_for_testing.STATUS_NORMAL_CLOSURE, reason='')
                 self._read_thread.request_stop()
+                try:
+                    self._stream.send_close(
+                        code=client_for_testing.STATUS_NORMAL_CLOSURE,
+                        reason='')
+                except socket.error, e:
+                    # The server may already have closed the socket after
+                    # replying to our closing handshake.
+                    self._logger.debug('Failed to reply to close: %r', e)
 
             if self._physical_connection_close_event:
                 self._physical_connection_close_event.set()
@@ -464,11 +471,17 @@ class MuxClient(object):
         self.close_socket()
 
     def _assert_channel_slot_available(self):
+        # Other control blocks also wake us up, e.g. the FlowControl the
+        # server sends right before NewChannelSlot, so wait until the
+        # deadline rather than only once.
+        deadline = time.time() + self._timeout
         try:
             self._control_blocks_condition.acquire()
-            if len(self._channel_slots) == 0:
-                # Wait once
-                self._control_blocks_condition.wait(timeout=self._timeout)
+            while len(self._channel_slots) == 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._control_blocks_condition.wait(timeout=remaining)
         finally:
             self._control_blocks_condition.release()
 
@@ -476,11 +489,14 @@ class MuxClient(object):
             raise Exception('Failed to receive NewChannelSlot')
 
     def _assert_send_quota_available(self, channel_id):
+        deadline = time.time() + self._timeout
         try:
             self._logical_channels_condition.acquire()
-            if self._logical_channels[channel_id].send_quota == 0:
-                # Wait once
-                self._logical_channels_condition.wait(timeout=self._timeout)
+            while self._logical_channels[channel_id].send_quota == 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._logical_channels_condition.wait(timeout=remaining)
         finally:
             self._logical_channels_condition.release()
 
@@ -489,11 +505,18 @@ class MuxClient(object):
                             channel_id)
 
     def connect(self):
-        self._socket = socket.socket()
+        if self._options.unix_socket:
+            self._socket = socket.socket(socket.AF_UNIX)
+            address = self._options.unix_socket
+        else:
+            self._socket = socket.socket()
+            if self._options.tcp_nodelay:
+                self._socket.setsockopt(
+                    socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            address = (self._options.server_host, self._options.server_port)
         self._socket.settimeout(self._options.socket_timeout)
 
-        self._socket.connect((self._options.server_host,
-                              self._options.server_port))
+        self._socket.connect(address)
         if self._options.use_tls:
             self._socket = _TLSSocket(self._socket)
 
@@ -41,19 +41,40 @@ To change loggin level, please specify --log-level option.
 To pass any option to unittest module, please specify options after '--'. For
 example, run this for making the test runner verbose.
     python test/run_test.py --log-level debug -- -v
+
+To run test modules in parallel, please specify the number of processes by
+--jobs option. Each test module is run in a separate process.
+    python test/run_test.py --jobs 4
+
+To spread the tests of a slow module over the processes too, please also
+specify --split option. Each test method is then run in a separate process.
+    python test/run_test.py --jobs 8 --split
+
+To run only some test modules, please specify --test-module option for each.
+    python test/run_test.py --test-module test_mux --test-module test_stream
+
+To stop on the first failure, please specify --failfast option. With --jobs,
+test modules not started yet are skipped once any test module fails.
+    python test/run_test.py --jobs 4 --failfast
 """
 
 
+from multiprocessing.pool import ThreadPool
 import logging
 import optparse
 import os
 import re
+import subprocess
 import sys
+import threading
 import unittest
 
 
 _TEST_MODULE_PATTERN = re.compile(r'^(test_.+)\.py$')
 
+# Names of the test modules _suite loads. None means all the test modules.
+_test_module_names = None
+
 
 def _list_test_modules(directory):
     module_names = []
@@ -64,10 +85,74 @@ def _list_test_modules(directory):
     return module_names
 
 
+def _all_test_modules():
+    return _list_test_modules(os.path.join(os.path.split(__file__)[0], '.'))
+
+
 def _suite():
     loader = unittest.TestLoader()
-    return loader.loadTestsFromNames(
-            _list_test_modules(os.path.join(os.path.split(__file__)[0], '.')))
+    module_names = _test_module_names
+    if module_names is None:
+        module_names = _all_test_modules()
+    return loader.loadTestsFromNames(module_names)
+
+
+def _list_test_ids(module_names):
+    """Returns the ids of all the test methods in the given test modules."""
+
+    test_ids = []
+    suites = [unittest.TestLoader().loadTestsFromNames(module_names)]
+    while suites:
+        for test in suites.pop():
+            if isinstance(test, unittest.TestSuite):
+                suites.append(test)
+            else:
+                test_ids.append(test.id())
+    return sorted(test_ids)
+
+
+def _run_in_parallel(module_names, jobs, log_level, failfast, unittest_args):
+    """Runs each of module_names in a separate process, at most jobs processes
+    at a time. module_names may also name test cases or test methods. Returns
+    True if all of them passed.
+    """
+
+    options = ['--log-level', log_level]
+    if failfast:
+        options.append('--failfast')
+    failure_event = threading.Event()
+
+    def run_module(module_name):
+        if failfast and failure_event.is_set():
+            return module_name, None, 'Skipped by --failfast'
+        process = subprocess.Popen(
+            [sys.executable, __file__] + options +
+            ['--test-module', module_name, '--'] + unittest_args,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            failure_event.set()
+        return module_name, process.returncode, output
+
+    pool = ThreadPool(jobs)
+    try:
+        results = pool.map(run_module, module_names)
+    finally:
+        pool.close()
+        pool.join()
+
+    failed_module_names = []
+    for module_name, returncode, output in results:
+        sys.stderr.write('==== %s\n%s\n' % (module_name, output))
+        if returncode is not None and returncode != 0:
+            failed_module_names.append(module_name)
+
+    if failed_module_names:
+        sys.stderr.write(
+            'FAILED test modules: %s\n' % ', '.join(failed_module_names))
+        return False
+    sys.stderr.write('All %d test modules passed\n' % len(module_names))
+    return True
 
 
 if __name__ == '__main__':
@@ -76,9 +161,34 @@ if __name__ == '__main__':
                       dest='log_level', default='warning',
                       choices=['debug', 'info', 'warning', 'warn', 'error',
                                'critical'])
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', default=1,
+                      help='number of processes to run test modules in')
+    parser.add_option('--test-module', '--test_module', dest='test_modules',
+                      action='append', metavar='MODULE',
+                      help='test module to run (all if not specified)')
+    parser.add_option('--split', dest='split', action='store_true',
+                      default=False,
+                      help='with --jobs, run each test method in its own '
+                      'process')
+    parser.add_option('-f', '--failfast', dest='failfast',
+                      action='store_true', default=False,
+                      help='stop on the first failure')
     options, args = parser.parse_args()
+
+    _test_module_names = options.test_modules
+
+    if options.jobs > 1:
+        module_names = _test_module_names or _all_test_modules()
+        if options.split:
+            module_names = _list_test_ids(module_names)
+        if not _run_in_parallel(module_names, options.jobs, options.log_level,
+                                options.failfast, args):
+            sys.exit(1)
+        sys.exit(0)
+
     logging.basicConfig(level=logging.getLevelName(options.log_level.upper()))
-    unittest.main(defaultTest='_suite', argv=[sys.argv[0]] + args)
+    unittest.main(defaultTest='_suite', argv=[sys.argv[0]] + args,
+                  failfast=options.failfast)
 
 
 # vi:sts=4 sw=4 et
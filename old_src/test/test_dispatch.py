@@ -122,6 +122,33 @@ class DispatcherTest(unittest.TestCase):
                 'def web_socket_do_extra_handshake(request):pass\n'
                 'def web_socket_transfer_data(request):pass\n'))
 
+    def test_source_handler_file_twice(self):
+        handler_definition = (
+            'def web_socket_do_extra_handshake(request):pass\n'
+            'def web_socket_transfer_data(request):pass\n')
+        suite1 = dispatch._source_handler_file(handler_definition, 'a_wsh.py')
+        suite2 = dispatch._source_handler_file(handler_definition, 'a_wsh.py')
+        # The compiled code is shared but each sourcing gets its own globals.
+        self.assertTrue(suite1.transfer_data.func_code is
+                        suite2.transfer_data.func_code)
+        self.assertFalse(suite1.transfer_data is suite2.transfer_data)
+        self.assertEqual('a_wsh.py',
+                         suite1.transfer_data.func_code.co_filename)
+
+    def test_source_edited_handler_file(self):
+        handler_definition = (
+            'def web_socket_do_extra_handshake(request):pass\n'
+            'def web_socket_transfer_data(request):return %d\n')
+        suite1 = dispatch._source_handler_file(handler_definition % 1,
+                                               'b_wsh.py')
+        suite2 = dispatch._source_handler_file(handler_definition % 2,
+                                               'b_wsh.py')
+        self.assertEqual(1, suite1.transfer_data(None))
+        self.assertEqual(2, suite2.transfer_data(None))
+        # Only the latest version of the source is kept.
+        self.assertEqual(handler_definition % 2,
+                         dispatch._handler_code_cache['b_wsh.py'][0])
+
     def test_source_warnings(self):
         dispatcher = dispatch.Dispatcher(_TEST_HANDLERS_DIR, None)
         warnings = dispatcher.source_warnings()
@@ -33,13 +33,17 @@
 """Test for end-to-end."""
 
 
+import copy
 import logging
 import os
 import signal
 import socket
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+import traceback
 import unittest
 
 import set_sys_path  # Update sys.path to locate mod_pywebsocket module.
@@ -56,15 +60,37 @@ _GOODBYE_MESSAGE = 'Goodbye'
 _use_external_server = False
 _external_server_port = 0
 
+# On Windows, close_fds=True cannot be combined with redirecting stdout or
+# stderr of the child. Elsewhere, descriptors are not close-on-exec by default
+# on Python 2, so close them not to leak sockets to the child.
+_CLOSE_FDS = sys.platform != 'win32'
+
+_IS_WINDOWS = sys.platform in ('win32', 'cygwin')
+
+# Passed to child processes so that they can import what the test runner can.
+_PYTHONPATH = os.path.pathsep.join(sys.path)
+
+# Port of the server listening on a UNIX domain socket. It's not listened to
+# but used in the Host header and validated by the server.
+_UNIX_SOCKET_SERVER_PORT = 80
+
 
 # Test body functions
+def _echo_batch(client, messages, binary=False):
+    """Sends all the messages back-to-back over the same connection and then
+    checks that they are echoed back in order.
+    """
+
+    for message in messages:
+        client.send_message(message, binary=binary)
+    for message in messages:
+        client.assert_receive(message, binary=binary)
+
+
 def _echo_check_procedure(client):
     client.connect()
 
-    client.send_message('test')
-    client.assert_receive('test')
-    client.send_message('helloworld')
-    client.assert_receive('helloworld')
+    _echo_batch(client, ['test', 'helloworld'])
 
     client.send_close()
     client.assert_receive_close()
@@ -75,10 +101,7 @@ def _echo_check_procedure(client):
 def _echo_check_procedure_with_binary(client):
     client.connect()
 
-    client.send_message('binary', binary=True)
-    client.assert_receive('binary', binary=True)
-    client.send_message('\x00\x80\xfe\xff\x00\x80', binary=True)
-    client.assert_receive('\x00\x80\xfe\xff\x00\x80', binary=True)
+    _echo_batch(client, ['binary', '\x00\x80\xfe\xff\x00\x80'], binary=True)
 
     client.send_close()
     client.assert_receive_close()
@@ -119,6 +142,31 @@ def _unmasked_frame_check_procedure(client):
     client.assert_connection_closed()
 
 
+def _protocol_error_check_procedure(client):
+    client.connect()
+
+    # Intermediate frame without any preceding start of fragmentation frame.
+    client.send_frame_of_arbitrary_bytes('\x80\x80', '')
+    client.assert_receive_close(client_for_testing.STATUS_PROTOCOL_ERROR)
+
+
+def _unsupported_frame_check_procedure(client):
+    client.connect()
+
+    # Text frame with RSV3 bit raised.
+    client.send_frame_of_arbitrary_bytes('\x91\x80', '')
+    client.assert_receive_close(client_for_testing.STATUS_UNSUPPORTED_DATA)
+
+
+def _invalid_frame_check_procedure(client):
+    client.connect()
+
+    # Text frame with invalid UTF-8 string.
+    client.send_message('\x80', raw=True)
+    client.assert_receive_close(
+        client_for_testing.STATUS_INVALID_FRAME_PAYLOAD_DATA)
+
+
 def _mux_echo_check_procedure(mux_client):
     mux_client.connect()
     mux_client.send_flow_control(1, 1024)
@@ -153,49 +201,119 @@ def _mux_echo_check_procedure(mux_client):
     mux_client.assert_physical_connection_receive_close()
 
 
-class EndToEndTest(unittest.TestCase):
-    """An end-to-end test that launches pywebsocket standalone server as a
-    separate process, connects to it using the client_for_testing module, and
-    checks if the server behaves correctly by exchanging opening handshake and
-    frames over a TCP connection.
+class EndToEndTestBase(unittest.TestCase):
+    """Base class for end-to-end tests that launches pywebsocket standalone
+    server as a separate process, connects to it using the client_for_testing
+    module, and checks if the server behaves correctly by exchanging opening
+    handshake and frames over a TCP connection or a UNIX domain socket.
+
+    The server is launched once in setUpClass and shared by all the test
+    methods of the class. Subclasses which need a differently configured
+    server override the class attributes below.
     """
 
-    def setUp(self):
-        self.server_stderr = None
-        self.top_dir = os.path.join(os.path.split(__file__)[0], '..')
-        os.putenv('PYTHONPATH', os.path.pathsep.join(sys.path))
-        self.standalone_command = os.path.join(
-            self.top_dir, 'mod_pywebsocket', 'standalone.py')
-        self.document_root = os.path.join(self.top_dir, 'example')
-        s = socket.socket()
-        s.bind(('localhost', 0))
-        (_, self.test_port) = s.getsockname()
-        s.close()
-
-        self._options = client_for_testing.ClientOptions()
-        self._options.server_host = 'localhost'
-        self._options.origin = 'http://localhost'
-        self._options.resource = '/echo'
-
-        # TODO(toyoshim): Eliminate launching a standalone server on using
-        # external server.
+    # If True, stderr of the server process is redirected to the null device.
+    # Otherwise, it's inherited from the test runner.
+    discard_server_stderr = False
+
+    # If True, the server listens on a UNIX domain socket instead of TCP when
+    # the platform supports it. This saves allocating a port and the overhead
+    # of TCP on the loopback interface.
+    use_unix_socket = False
+
+    top_dir = os.path.join(os.path.split(__file__)[0], '..')
+    standalone_command = os.path.join(
+        top_dir, 'mod_pywebsocket', 'standalone.py')
+    document_root = os.path.join(top_dir, 'example')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.child_env = os.environ.copy()
+        cls.child_env['PYTHONPATH'] = _PYTHONPATH
+
+        cls.server = None
+        cls.unix_socket = None
+        if (cls.use_unix_socket and hasattr(socket, 'AF_UNIX') and
+            not _use_external_server):
+            cls.unix_socket = os.path.join(
+                tempfile.gettempdir(),
+                'pywebsocket-%d-%s.sock' % (os.getpid(), cls.__name__))
+            cls.test_port = _UNIX_SOCKET_SERVER_PORT
+            cls._start_server()
+        else:
+            # Keep the socket bound to the reserved port until the server
+            # starts listening on it so that no other process is assigned the
+            # same port in the meantime. The server can still bind the port as
+            # both sockets set SO_REUSEADDR and this one never listens.
+            port_holder = socket.socket()
+            port_holder.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            port_holder.bind(('localhost', 0))
+            (_, cls.test_port) = port_holder.getsockname()
+
+            try:
+                if not _use_external_server:
+                    cls._start_server()
+            finally:
+                port_holder.close()
+
+        # Template of the client options. Each test gets its own copy.
+        cls.default_options = client_for_testing.ClientOptions()
+        cls.default_options.server_host = 'localhost'
+        cls.default_options.origin = 'http://localhost'
+        cls.default_options.resource = '/echo'
+        cls.default_options.unix_socket = cls.unix_socket
 
         if _use_external_server:
-            self._options.server_port = _external_server_port
+            cls.default_options.server_port = _external_server_port
         else:
-            self._options.server_port = self.test_port
-
-    def _run_python_command(self, commandline, stdout=None, stderr=None):
-        return subprocess.Popen([sys.executable] + commandline, close_fds=True,
-                                stdout=stdout, stderr=stderr)
+            cls.default_options.server_port = cls.test_port
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.server is not None:
+            cls._kill_process(cls.server)
+            cls.server = None
+        # The killed server doesn't remove the socket file by itself.
+        if cls.unix_socket is not None and os.path.exists(cls.unix_socket):
+            os.remove(cls.unix_socket)
+
+    @classmethod
+    def _start_server(cls):
+        """Launches the server and waits until it accepts connections."""
+
+        # tearDownClass isn't run when setUpClass fails, so kill the server
+        # and remove its socket file here.
+        try:
+            cls.server = cls._run_server()
+            cls._wait_for_server()
+        except:
+            cls.tearDownClass()
+            raise
 
-    def _run_server(self, allow_draft75=False):
-        args = [self.standalone_command,
+    def setUp(self):
+        # Deep copy so that e.g. enable_deflate_stream doesn't modify the
+        # extensions list of the template.
+        self._options = copy.deepcopy(self.default_options)
+
+    @classmethod
+    def _run_python_command(cls, commandline, stdout=None, stderr=None,
+                            preexec_fn=None):
+        # -S skips importing the site module. PYTHONPATH already contains
+        # sys.path of the test runner including the site directories.
+        return subprocess.Popen([sys.executable, '-S'] + commandline,
+                                close_fds=_CLOSE_FDS, env=cls.child_env,
+                                stdout=stdout, stderr=stderr,
+                                preexec_fn=preexec_fn)
+
+    @classmethod
+    def _run_server(cls, allow_draft75=False):
+        args = [cls.standalone_command,
                 '-H', 'localhost',
                 '-V', 'localhost',
-                '-p', str(self.test_port),
-                '-P', str(self.test_port),
-                '-d', self.document_root]
+                '-p', str(cls.test_port),
+                '-P', str(cls.test_port),
+                '-d', cls.document_root]
 
         # Inherit the level set to the root logger by test runner.
         root_logger = logging.getLogger()
@@ -207,118 +325,155 @@ class EndToEndTest(unittest.TestCase):
         if allow_draft75:
             args.append('--allow-draft75')
 
-        return self._run_python_command(args,
-                                        stderr=self.server_stderr)
+        if cls.unix_socket is not None:
+            args.append('--unix-socket')
+            args.append(cls.unix_socket)
 
-    def _kill_process(self, pid):
-        if sys.platform in ('win32', 'cygwin'):
-            subprocess.call(
-                ('taskkill.exe', '/f', '/pid', str(pid)), close_fds=True)
-        else:
-            os.kill(pid, signal.SIGKILL)
+        # Make the server the leader of a new process group so that
+        # _kill_process can kill it together with CGI scripts it runs.
+        preexec_fn = None
+        if not _IS_WINDOWS:
+            preexec_fn = os.setpgrp
 
-    def _run_hybi_test_with_client_options(self, test_function, options):
-        server = self._run_server()
+        if not cls.discard_server_stderr:
+            return cls._run_python_command(args, preexec_fn=preexec_fn)
+
+        # Unlike a pipe nobody reads, the null device never blocks the server
+        # on writing to stderr.
+        devnull = open(os.devnull, 'w')
         try:
-            # TODO(tyoshino): add some logic to poll the server until it
-            # becomes ready
-            time.sleep(0.2)
+            return cls._run_python_command(
+                args, stderr=devnull, preexec_fn=preexec_fn)
+        finally:
+            devnull.close()
 
-            client = client_for_testing.create_client(options)
+    @classmethod
+    def _wait_for_server(cls, timeout=5.0):
+        """Polls the server until it accepts a connection or the timeout
+        expires.
+        """
+
+        if cls.unix_socket is not None:
+            family = socket.AF_UNIX
+            address = cls.unix_socket
+        else:
+            family = socket.AF_INET
+            address = ('localhost', cls.test_port)
+
+        deadline = time.time() + timeout
+        while True:
+            s = socket.socket(family)
+            s.settimeout(0.05)
             try:
-                test_function(client)
+                s.connect(address)
+                return
+            except socket.error:
+                if time.time() >= deadline:
+                    raise Exception(
+                        'Server did not start listening on %r in %r '
+                        'seconds' % (address, timeout))
+                time.sleep(0.005)
             finally:
-                client.close_socket()
+                s.close()
+
+    @classmethod
+    def _kill_process(cls, process, timeout=0.5):
+        if _IS_WINDOWS:
+            process.kill()
+            process.wait()
+            return
+
+        # Ask the process group to terminate first, and kill it only when it
+        # doesn't exit within the timeout.
+        os.killpg(process.pid, signal.SIGTERM)
+        deadline = time.time() + timeout
+        while process.poll() is None:
+            if time.time() >= deadline:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                return
+            time.sleep(0.005)
+
+    def _run_concurrently(self, run_function, args_list):
+        """Calls run_function with each of args_list in its own thread so that
+        e.g. opening handshakes of independent connections overlap, and then
+        fails with the traceback of the first exception raised, if any.
+        """
+
+        errors = []
+
+        def run(*args):
+            try:
+                run_function(*args)
+            except Exception:
+                errors.append(traceback.format_exc())
+
+        threads = [threading.Thread(target=run, args=args)
+                   for args in args_list]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            self.fail(errors[0])
+
+    def _run_with_client(self, test_function, client, *args):
+        try:
+            test_function(client, *args)
         finally:
-            self._kill_process(server.pid)
+            client.close_socket()
+
+    def _run_hybi_test_with_client_options(self, test_function, options):
+        self._run_with_client(
+            test_function, client_for_testing.create_client(options))
 
     def _run_hybi_test(self, test_function):
         self._run_hybi_test_with_client_options(test_function, self._options)
 
     def _run_hybi_deflate_test(self, test_function):
-        server = self._run_server()
-        try:
-            time.sleep(0.2)
-
-            self._options.enable_deflate_stream()
-            client = client_for_testing.create_client(self._options)
-            try:
-                test_function(client)
-            finally:
-                client.close_socket()
-        finally:
-            self._kill_process(server.pid)
+        self._options.enable_deflate_stream()
+        self._run_hybi_test(test_function)
 
     def _run_hybi_deflate_frame_test(self, test_function):
-        server = self._run_server()
-        try:
-            time.sleep(0.2)
-
-            self._options.enable_deflate_frame()
-            client = client_for_testing.create_client(self._options)
-            try:
-                test_function(client)
-            finally:
-                client.close_socket()
-        finally:
-            self._kill_process(server.pid)
+        self._options.enable_deflate_frame()
+        self._run_hybi_test(test_function)
 
     def _run_hybi_close_with_code_and_reason_test(self, test_function, code,
                                                   reason):
-        server = self._run_server()
-        try:
-            time.sleep(0.2)
+        self._run_with_client(
+            test_function, client_for_testing.create_client(self._options),
+            code, reason)
 
-            client = client_for_testing.create_client(self._options)
-            try:
-                test_function(client, code, reason)
-            finally:
-                client.close_socket()
-        finally:
-            self._kill_process(server.pid)
+    def _run_hybi_mux_test(self, test_function):
+        self._run_with_client(
+            test_function, mux_client_for_testing.MuxClient(self._options))
 
-    def _run_hybi_http_fallback_test(self, options, status):
-        server = self._run_server()
-        try:
-            time.sleep(0.2)
+    def _run_hybi00_test(self, test_function):
+        self._run_with_client(
+            test_function,
+            client_for_testing.create_client_hybi00(self._options))
 
-            client = client_for_testing.create_client(options)
-            try:
-                client.connect()
-                self.fail('Could not catch HttpStatusException')
-            except client_for_testing.HttpStatusException, e:
-                self.assertEqual(status, e.status)
-            except Exception, e:
-                self.fail('Catch unexpected exception')
-            finally:
-                client.close_socket()
-        finally:
-            self._kill_process(server.pid)
 
-    def _run_hybi_mux_test(self, test_function):
-        server = self._run_server()
-        try:
-            time.sleep(0.2)
+class EndToEndTest(EndToEndTestBase):
+    """End-to-end tests which share a standalone server whose stderr is
+    inherited from the test runner.
+    """
 
-            client = mux_client_for_testing.MuxClient(self._options)
-            try:
-                test_function(client)
-            finally:
-                client.close_socket()
-        finally:
-            self._kill_process(server.pid)
+    use_unix_socket = True
 
     def test_echo(self):
-        self._run_hybi_test(_echo_check_procedure)
-
-    def test_echo_binary(self):
-        self._run_hybi_test(_echo_check_procedure_with_binary)
-
-    def test_echo_server_close(self):
-        self._run_hybi_test(_echo_check_procedure_with_goodbye)
+        """Tests text and binary echo, server initiated closing handshake and
+        closing on unmasked frame. Each procedure runs concurrently on a new
+        connection to the shared server.
+        """
 
-    def test_unmasked_frame(self):
-        self._run_hybi_test(_unmasked_frame_check_procedure)
+        self._run_concurrently(
+            self._run_hybi_test,
+            [(_echo_check_procedure,),
+             (_echo_check_procedure_with_binary,),
+             (_echo_check_procedure_with_goodbye,),
+             (_unmasked_frame_check_procedure,)])
 
     def test_echo_deflate(self):
         self._run_hybi_deflate_test(_echo_check_procedure)
@@ -335,13 +490,12 @@ class EndToEndTest(unittest.TestCase):
 
     def test_echo_close_with_code_and_reason(self):
         self._options.resource = '/close'
-        self._run_hybi_close_with_code_and_reason_test(
-            _echo_check_procedure_with_code_and_reason, 3333, 'sunsunsunsun')
-
-    def test_echo_close_with_empty_body(self):
-        self._options.resource = '/close'
-        self._run_hybi_close_with_code_and_reason_test(
-            _echo_check_procedure_with_code_and_reason, None, '')
+        # The second case sends a close frame with empty body.
+        self._run_concurrently(
+            self._run_hybi_close_with_code_and_reason_test,
+            [(_echo_check_procedure_with_code_and_reason, 3333,
+              'sunsunsunsun'),
+             (_echo_check_procedure_with_code_and_reason, None, '')])
 
     def test_mux_echo(self):
         self._run_hybi_mux_test(_mux_echo_check_procedure)
@@ -351,16 +505,7 @@ class EndToEndTest(unittest.TestCase):
         code when the client sends data with some protocol error.
         """
 
-        def test_function(client):
-            client.connect()
-
-            # Intermediate frame without any preceding start of fragmentation
-            # frame.
-            client.send_frame_of_arbitrary_bytes('\x80\x80', '')
-            client.assert_receive_close(
-                client_for_testing.STATUS_PROTOCOL_ERROR)
-
-        self._run_hybi_test(test_function)
+        self._run_hybi_test(_protocol_error_check_procedure)
 
     def test_close_on_unsupported_frame(self):
         """Tests that the server sends a close frame with unsupported operation
@@ -368,15 +513,7 @@ class EndToEndTest(unittest.TestCase):
         not supported by the server.
         """
 
-        def test_function(client):
-            client.connect()
-
-            # Text frame with RSV3 bit raised.
-            client.send_frame_of_arbitrary_bytes('\x91\x80', '')
-            client.assert_receive_close(
-                client_for_testing.STATUS_UNSUPPORTED_DATA)
-
-        self._run_hybi_test(test_function)
+        self._run_hybi_test(_unsupported_frame_check_procedure)
 
     def test_close_on_invalid_frame(self):
         """Tests that the server sends a close frame with invalid frame payload
@@ -384,28 +521,7 @@ class EndToEndTest(unittest.TestCase):
         invalid UTF-8 character.
         """
 
-        def test_function(client):
-            client.connect()
-
-            # Text frame with invalid UTF-8 string.
-            client.send_message('\x80', raw=True)
-            client.assert_receive_close(
-                client_for_testing.STATUS_INVALID_FRAME_PAYLOAD_DATA)
-
-        self._run_hybi_test(test_function)
-
-    def _run_hybi00_test(self, test_function):
-        server = self._run_server()
-        try:
-            time.sleep(0.2)
-
-            client = client_for_testing.create_client_hybi00(self._options)
-            try:
-                test_function(client)
-            finally:
-                client.close_socket()
-        finally:
-            self._kill_process(server.pid)
+        self._run_hybi_test(_invalid_frame_check_procedure)
 
     def test_echo_hybi00(self):
         self._run_hybi00_test(_echo_check_procedure)
@@ -424,23 +540,11 @@ class EndToEndTest(unittest.TestCase):
         options.resource = 'ws://localhost:%d/echo' % options.server_port
         self._run_hybi_test_with_client_options(_echo_check_procedure, options)
 
-    def test_origin_check(self):
-        """Tests http fallback on origin check fail."""
-
-        options = self._options
-        options.resource = '/origin_check'
-        # Server shows warning message for http 403 fallback. This warning
-        # message is confusing. Following pipe disposes warning messages.
-        self.server_stderr = subprocess.PIPE
-        self._run_hybi_http_fallback_test(options, 403)
 
-    def test_version_check(self):
-        """Tests http fallback on version check fail."""
-
-        options = self._options
-        options.version = 99
-        self.server_stderr = subprocess.PIPE
-        self._run_hybi_http_fallback_test(options, 400)
+class ExampleEchoClientTest(EndToEndTestBase):
+    """End-to-end test for the echo_client.py example. The example connects
+    to the server over TCP.
+    """
 
     def _check_example_echo_client_result(
         self, expected, stdoutdata, stderrdata):
@@ -456,38 +560,74 @@ class EndToEndTest(unittest.TestCase):
     def test_example_echo_client(self):
         """Tests that the echo_client.py example can talk with the server."""
 
-        server = self._run_server()
+        client_command = os.path.join(
+            self.top_dir, 'example', 'echo_client.py')
+
+        args = [client_command,
+                '-p', str(self._options.server_port)]
+        expected = ('Send: Hello\n' 'Recv: Hello\n'
+            u'Send: \u65e5\u672c\n' u'Recv: \u65e5\u672c\n'
+            'Send close\n' 'Recv ack\n')
+
+        # Process a big message for which extended payload length is used.
+        # To handle extended payload length, ws_version attribute will be
+        # accessed. This test checks that ws_version is correctly set.
+        big_message = 'a' * 1024
+        big_message_args = [client_command,
+                            '-p', str(self._options.server_port),
+                            '-m', big_message]
+        big_message_expected = (
+            'Send: %s\nRecv: %s\nSend close\nRecv ack\n' %
+            (big_message, big_message))
+
+        # The two clients are independent. Run them concurrently.
+        client = self._run_python_command(args, stdout=subprocess.PIPE)
+        big_message_client = self._run_python_command(
+            big_message_args, stdout=subprocess.PIPE)
+
+        stdoutdata, stderrdata = client.communicate()
+        big_message_stdoutdata, big_message_stderrdata = (
+            big_message_client.communicate())
+
+        self._check_example_echo_client_result(
+            expected, stdoutdata, stderrdata)
+        self._check_example_echo_client_result(
+            big_message_expected, big_message_stdoutdata,
+            big_message_stderrdata)
+
+
+class EndToEndHttpFallbackTest(EndToEndTestBase):
+    """End-to-end tests for http fallback on handshake failure."""
+
+    # Server shows warning message for http fallback. This warning message is
+    # confusing. Dispose warning messages.
+    discard_server_stderr = True
+
+    def _run_hybi_http_fallback_test(self, options, status):
+        client = client_for_testing.create_client(options)
         try:
-            time.sleep(0.2)
-
-            client_command = os.path.join(
-                self.top_dir, 'example', 'echo_client.py')
-
-            args = [client_command,
-                    '-p', str(self._options.server_port)]
-            client = self._run_python_command(args, stdout=subprocess.PIPE)
-            stdoutdata, stderrdata = client.communicate()
-            expected = ('Send: Hello\n' 'Recv: Hello\n'
-                u'Send: \u65e5\u672c\n' u'Recv: \u65e5\u672c\n'
-                'Send close\n' 'Recv ack\n')
-            self._check_example_echo_client_result(
-                expected, stdoutdata, stderrdata)
-
-            # Process a big message for which extended payload length is used.
-            # To handle extended payload length, ws_version attribute will be
-            # accessed. This test checks that ws_version is correctly set.
-            big_message = 'a' * 1024
-            args = [client_command,
-                    '-p', str(self._options.server_port),
-                    '-m', big_message]
-            client = self._run_python_command(args, stdout=subprocess.PIPE)
-            stdoutdata, stderrdata = client.communicate()
-            expected = ('Send: %s\nRecv: %s\nSend close\nRecv ack\n' %
-                        (big_message, big_message))
-            self._check_example_echo_client_result(
-                expected, stdoutdata, stderrdata)
+            client.connect()
+            self.fail('Could not catch HttpStatusException')
+        except client_for_testing.HttpStatusException as e:
+            self.assertEqual(status, e.status)
+        except Exception as e:
+            self.fail('Catch unexpected exception')
         finally:
-            self._kill_process(server.pid)
+            client.close_socket()
+
+    def test_origin_check(self):
+        """Tests http fallback on origin check fail."""
+
+        options = self._options
+        options.resource = '/origin_check'
+        self._run_hybi_http_fallback_test(options, 403)
+
+    def test_version_check(self):
+        """Tests http fallback on version check fail."""
+
+        options = self._options
+        options.version = 99
+        self._run_hybi_http_fallback_test(options, 400)
 
 
 if __name__ == '__main__':
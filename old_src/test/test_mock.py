@@ -107,6 +107,15 @@ class MockBlockingConnTest(unittest.TestCase):
         read = queue.get()
         self.assertEqual('Foo bar\r\n', read)
 
+    def test_read_across_chunks(self):
+        conn = mock.MockBlockingConn()
+        conn.put_bytes('Hel')
+        conn.put_bytes('lo\r\nWor')
+        conn.put_bytes('ld')
+        self.assertEqual('Hello\r\n', conn.readline())
+        self.assertEqual('Wo', conn.read(2))
+        self.assertEqual('rld', conn.read(3))
+
 
 class MockTableTest(unittest.TestCase):
     """A unittest for MockTable class."""
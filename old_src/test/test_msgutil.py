@@ -36,6 +36,7 @@
 import array
 import Queue
 import struct
+import threading
 import unittest
 import zlib
 
@@ -1053,6 +1054,45 @@ class MessageSenderTest(unittest.TestCase):
         self.assertEqual('\x81\x05Hello', send_queue.get())
         self.assertEqual('\x81\x05World', send_queue.get())
 
+    def test_send_after_send_nowait(self):
+        request = _create_blocking_request()
+        sender = msgutil.MessageSender(request)
+
+        sender.send_nowait('Hello')
+        sender.send('World')
+        self.assertEqual('\x81\x05Hello\x81\x05World',
+                         request.connection.written_data())
+
+    def test_send_nowait_during_send(self):
+        written = Queue.Queue()
+        write_released = threading.Event()
+
+        def write(bytes):
+            written.put(bytes)
+            write_released.wait()
+
+        request = _create_blocking_request()
+        request.connection.write = write
+
+        sender = msgutil.MessageSender(request)
+
+        send_thread = threading.Thread(target=sender.send, args=('Hello',))
+        send_thread.start()
+        self.assertEqual('\x81\x05Hello', written.get())
+
+        # send() is now stuck writing to a slow peer. send_nowait() must not
+        # wait for it.
+        send_nowait_thread = threading.Thread(
+            target=sender.send_nowait, args=('World',))
+        send_nowait_thread.start()
+        send_nowait_thread.join(1)
+        send_nowait_blocked = send_nowait_thread.isAlive()
+
+        write_released.set()
+        self.assertFalse(send_nowait_blocked)
+        self.assertEqual('\x81\x05World', written.get())
+        send_thread.join()
+
 
 class MessageSenderHixie75Test(unittest.TestCase):
     """Tests the StreamHixie75 class using MessageSender."""
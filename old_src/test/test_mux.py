@@ -49,19 +49,47 @@ from mod_pywebsocket._stream_hybi import StreamOptions
 from mod_pywebsocket._stream_hybi import create_binary_frame
 from mod_pywebsocket._stream_hybi import create_close_frame
 from mod_pywebsocket._stream_hybi import create_closing_handshake_body
-from mod_pywebsocket._stream_hybi import parse_frame
 
 
 import mock
 
 
-class _OutgoingChannelData(object):
-    def __init__(self):
-        self.messages = []
-        self.control_messages = []
-
-        self.current_opcode = None
-        self.pending_fragments = []
+def _parse_unmasked_frames(data):
+    """Parses the unmasked frames that fill data. Yields (opcode, payload,
+    fin) for each of them.
+
+    This is a lean replacement of parse_frame for the frames the server
+    writes to _MockMuxConnection. It reads the headers directly instead of
+    through a receive_bytes callback, and returns the payloads as zero-copy
+    views.
+    """
+
+    view = memoryview(data)
+    length = len(view)
+    position = 0
+    while position < length:
+        if length - position < 2:
+            raise Exception('Sending truncated frame header')
+        first_byte = ord(view[position])
+        second_byte = ord(view[position + 1])
+        if second_byte & 0x80:
+            raise Exception('Sending masked frame')
+
+        payload_length = second_byte & 0x7f
+        position += 2
+        if payload_length == 126:
+            payload_length = ((ord(view[position]) << 8) |
+                              ord(view[position + 1]))
+            position += 2
+        elif payload_length == 127:
+            payload_length = struct.unpack_from('!Q', data, position)[0]
+            position += 8
+        end = position + payload_length
+        if end > length:
+            raise Exception('Sending frame with wrong payload length')
+
+        yield first_byte & 0xf, view[position:end], first_byte >> 7
+        position = end
 
 
 class _MockMuxConnection(mock.MockBlockingConn):
@@ -70,32 +98,27 @@ class _MockMuxConnection(mock.MockBlockingConn):
     def __init__(self):
         mock.MockBlockingConn.__init__(self)
         self._control_blocks = []
-        self._channel_data = {}
+        self._control_blocks_by_opcode = {}
+        # Per channel state of written logical frames, keyed by channel id.
+        self._messages = {}
+        self._control_messages = {}
+        self._channel_opcodes = {}
+        self._channel_buffers = {}
 
         self._current_opcode = None
-        self._pending_fragments = []
+        self._pending_buf = bytearray()
+        self._parser = mux._MuxFramePayloadParser('')
 
         self.server_close_code = None
 
     def write(self, data):
         """Override MockBlockingConn.write."""
 
-        self._current_data = data
-        self._position = 0
-
-        def _receive_bytes(length):
-            if self._position + length > len(self._current_data):
-                raise ConnectionTerminatedException(
-                    'Failed to receive %d bytes from encapsulated '
-                    'frame' % length)
-            data = self._current_data[self._position:self._position+length]
-            self._position += length
-            return data
+        for opcode, payload, fin in _parse_unmasked_frames(data):
+            self._write_frame(opcode, payload, fin)
 
-        opcode, payload, fin, rsv1, rsv2, rsv3 = (
-            parse_frame(_receive_bytes, unmask_receive=False))
-
-        self._pending_fragments.append(payload)
+    def _write_frame(self, opcode, payload, fin):
+        self._pending_buf.extend(payload)
 
         if self._current_opcode is None:
             if opcode == common.OPCODE_CONTINUATION:
@@ -107,64 +130,77 @@ class _MockMuxConnection(mock.MockBlockingConn):
         if not fin:
             return
 
-        inner_frame_data = ''.join(self._pending_fragments)
-        self._pending_fragments = []
+        inner_frame_data = str(self._pending_buf)
+        del self._pending_buf[:]
         self._current_opcode = None
 
         # TODO(bashi): Support other opcodes if needed.
         if opcode == common.OPCODE_CLOSE:
             if len(payload) >= 2:
-                self.server_close_code = struct.unpack('!H', payload[:2])[0]
+                self.server_close_code = (
+                    (ord(payload[0]) << 8) | ord(payload[1]))
             close_body = create_closing_handshake_body(
                 common.STATUS_NORMAL_CLOSURE, '')
             close_frame = create_close_frame(close_body, mask=True)
             self.put_bytes(close_frame)
             return
 
-        parser = mux._MuxFramePayloadParser(inner_frame_data)
+        parser = self._parser
+        parser.reset(inner_frame_data)
         channel_id = parser.read_channel_id()
         if channel_id == mux._CONTROL_CHANNEL_ID:
-            self._control_blocks.extend(list(parser.read_control_blocks()))
+            for block in parser.read_control_blocks():
+                self._control_blocks.append(block)
+                self._control_blocks_by_opcode.setdefault(
+                    block.opcode, []).append(block)
             return
 
-        if not channel_id in self._channel_data:
-            self._channel_data[channel_id] = _OutgoingChannelData()
-        channel_data = self._channel_data[channel_id]
+        if not channel_id in self._messages:
+            self._messages[channel_id] = []
+            self._control_messages[channel_id] = []
+            self._channel_opcodes[channel_id] = None
+            self._channel_buffers[channel_id] = bytearray()
+        pending_buf = self._channel_buffers[channel_id]
+        current_opcode = self._channel_opcodes[channel_id]
 
         (inner_fin, inner_rsv1, inner_rsv2, inner_rsv3, inner_opcode,
          inner_payload) = parser.read_inner_frame()
-        channel_data.pending_fragments.append(inner_payload)
+        pending_buf.extend(inner_payload)
 
-        if channel_data.current_opcode is None:
+        if current_opcode is None:
             if inner_opcode == common.OPCODE_CONTINUATION:
                 raise Exception('Sending invalid continuation opcode')
-            channel_data.current_opcode = inner_opcode
+            current_opcode = inner_opcode
         else:
             if inner_opcode != common.OPCODE_CONTINUATION:
                 raise Exception('Sending invalid opcode %d' % inner_opcode)
         if not inner_fin:
+            self._channel_opcodes[channel_id] = current_opcode
             return
 
-        message = ''.join(channel_data.pending_fragments)
-        channel_data.pending_fragments = []
+        message = str(pending_buf)
+        del pending_buf[:]
 
-        if (channel_data.current_opcode == common.OPCODE_TEXT or
-            channel_data.current_opcode == common.OPCODE_BINARY):
-            channel_data.messages.append(message)
+        if (current_opcode == common.OPCODE_TEXT or
+            current_opcode == common.OPCODE_BINARY):
+            self._messages[channel_id].append(message)
         else:
-            channel_data.control_messages.append(
-                {'opcode': channel_data.current_opcode,
+            self._control_messages[channel_id].append(
+                {'opcode': current_opcode,
                  'message': message})
-        channel_data.current_opcode = None
+        self._channel_opcodes[channel_id] = None
 
     def get_written_control_blocks(self):
         return self._control_blocks
 
+    def get_written_control_blocks_by_opcode(self, opcode):
+        return self._control_blocks_by_opcode.get(opcode, [])
+
     def get_written_messages(self, channel_id):
-        return self._channel_data[channel_id].messages
+        return self._messages[channel_id]
 
     def get_written_control_messages(self, channel_id):
-        return self._channel_data[channel_id].control_messages
+        return self._control_messages[channel_id]
 
 
 class _ChannelEvent(object):
@@ -225,15 +261,19 @@ class _MuxMockDispatcher(object):
             raise
 
 
+# Opening handshake headers of the physical connection. MockRequest copies
+# them into its own table, so one dict serves every test.
+_MOCK_REQUEST_HEADERS = {'Host': 'server.example.com',
+                         'Upgrade': 'websocket',
+                         'Connection': 'Upgrade',
+                         'Sec-WebSocket-Key': 'dGhlIHNhbXBsZSBub25jZQ==',
+                         'Sec-WebSocket-Version': '13',
+                         'Origin': 'http://example.com'}
+
+
 def _create_mock_request():
-    headers = {'Host': 'server.example.com',
-               'Upgrade': 'websocket',
-               'Connection': 'Upgrade',
-               'Sec-WebSocket-Key': 'dGhlIHNhbXBsZSBub25jZQ==',
-               'Sec-WebSocket-Version': '13',
-               'Origin': 'http://example.com'}
     request = mock.MockRequest(uri='/echo',
-                               headers_in=headers,
+                               headers_in=_MOCK_REQUEST_HEADERS,
                                connection=_MockMuxConnection())
     request.ws_stream = Stream(request, options=StreamOptions())
     request.mux = True
@@ -242,30 +282,93 @@ def _create_mock_request():
     return request
 
 
+# Encodings of the few channel ids and numbers the helpers below use.
+_encoded_channel_ids = {}
+_encoded_numbers = {}
+
+
+def _encode_channel_id(channel_id):
+    encoded = _encoded_channel_ids.get(channel_id)
+    if encoded is None:
+        encoded = mux._encode_channel_id(channel_id)
+        _encoded_channel_ids[channel_id] = encoded
+    return encoded
+
+
+def _encode_number(number):
+    encoded = _encoded_numbers.get(number)
+    if encoded is None:
+        encoded = mux._encode_number(number)
+        _encoded_numbers[number] = encoded
+    return encoded
+
+
+# Frames built by the helpers below, keyed by their arguments. The masking
+# key of a cached frame is reused across tests, which is fine as the server
+# doesn't care which key the client picks.
+_frame_cache = {}
+
+
 def _create_add_channel_request_frame(channel_id, encoding, encoded_handshake):
+    key = ('add_channel_request', channel_id, encoding, encoded_handshake)
+    frame = _frame_cache.get(key)
+    if frame is not None:
+        return frame
+
     # Allow invalid encoding for testing.
     first_byte = ((mux._MUX_OPCODE_ADD_CHANNEL_REQUEST << 5) | encoding)
-    block = (chr(first_byte) +
-             mux._encode_channel_id(channel_id) +
-             mux._encode_number(len(encoded_handshake)) +
-             encoded_handshake)
-    payload = mux._encode_channel_id(mux._CONTROL_CHANNEL_ID) + block
-    return create_binary_frame(payload, mask=True)
+    payload = ''.join([_encode_channel_id(mux._CONTROL_CHANNEL_ID),
+                       chr(first_byte),
+                       _encode_channel_id(channel_id),
+                       _encode_number(len(encoded_handshake)),
+                       encoded_handshake])
+    frame = create_binary_frame(payload, mask=True)
+    _frame_cache[key] = frame
+    return frame
 
 
 def _create_logical_frame(channel_id, message, opcode=common.OPCODE_BINARY,
                           fin=True, mask=True):
-    bits = chr((fin << 7) | opcode)
-    payload = mux._encode_channel_id(channel_id) + bits + message
-    return create_binary_frame(payload, mask=mask)
+    key = ('logical', channel_id, message, opcode, fin, mask)
+    frame = _frame_cache.get(key)
+    if frame is not None:
+        return frame
+
+    payload = ''.join([_encode_channel_id(channel_id),
+                       chr((fin << 7) | opcode),
+                       message])
+    frame = create_binary_frame(payload, mask=mask)
+    _frame_cache[key] = frame
+    return frame
+
+
+# Frames that make the echo handler on the channel return. Nearly every
+# MuxHandlerTest sends them to let the handler finish.
+_GOODBYE_FRAME_ON_CHANNEL_1 = _create_logical_frame(channel_id=1,
+                                                    message='Goodbye')
+_GOODBYE_FRAME_ON_CHANNEL_2 = _create_logical_frame(channel_id=2,
+                                                    message='Goodbye')
+
+
+def _put_frames(connection, *frames):
+    """Puts frames to be read from connection in one chunk."""
+
+    connection.put_bytes(''.join(frames))
+
+
+_request_headers = {}
 
 
 def _create_request_header(path='/echo'):
-    return (
-        'GET %s HTTP/1.1\r\n'
-        'Host: server.example.com\r\n'
-        'Origin: http://example.com\r\n'
-        '\r\n') % path
+    request_header = _request_headers.get(path)
+    if request_header is None:
+        request_header = (
+            'GET %s HTTP/1.1\r\n'
+            'Host: server.example.com\r\n'
+            'Origin: http://example.com\r\n'
+            '\r\n') % path
+        _request_headers[path] = request_header
+    return request_header
 
 
 class MuxTest(unittest.TestCase):
@@ -469,64 +572,83 @@ class MuxTest(unittest.TestCase):
         self.assertEqual('server.example.com', headers['Host'])
         self.assertEqual('http://example.com', headers['Origin'])
 
+    def test_logical_connection_read(self):
+        connection = mux._LogicalConnection(None, 2)
+        connection.append_frame('Hel', 'lo, W')
+        connection.append_frame('orld', '')
+        self.assertEqual('He', connection.read(2))
+        self.assertEqual('llo, Wo', connection.read(7))
+        self.assertEqual('', connection.read(0))
+        self.assertEqual('rld', connection.read(3))
+
+    def test_logical_connection_append_frame(self):
+        connection = mux._LogicalConnection(None, 2)
+        connection.append_frame('\x81\x05', 'Hello')
+        connection.append_frame('\x81\x00', '')
+        self.assertEqual('\x81\x05', connection.read(2))
+        self.assertEqual('Hello', connection.read(5))
+        self.assertEqual('\x81\x00', connection.read(2))
+
 
 class MuxHandlerTest(unittest.TestCase):
 
+    def setUp(self):
+        self.request = _create_mock_request()
+        self.dispatcher = _MuxMockDispatcher()
+        self.mux_handler = mux._MuxHandler(self.request, self.dispatcher)
+        self.mux_handler.start()
+
+    def _add_channel_slots(self, slots=mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
+                           send_quota=mux._INITIAL_QUOTA_FOR_CLIENT):
+        self.mux_handler.add_channel_slots(slots, send_quota)
+
     def test_add_channel(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=2,
                                                 replenished_quota=6,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
 
-        encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=3, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=3,
                                                 replenished_quota=6,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
 
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=2, message='Hello'))
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=3, message='World'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Goodbye'))
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_2)
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=3, message='Goodbye'))
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        self.assertEqual([], dispatcher.channel_events[1].messages)
-        self.assertEqual(['Hello'], dispatcher.channel_events[2].messages)
-        self.assertEqual(['World'], dispatcher.channel_events[3].messages)
+        self.assertEqual([], self.dispatcher.channel_events[1].messages)
+        self.assertEqual(['Hello'], self.dispatcher.channel_events[2].messages)
+        self.assertEqual(['World'], self.dispatcher.channel_events[3].messages)
         # Channel 2
-        messages = request.connection.get_written_messages(2)
+        messages = self.request.connection.get_written_messages(2)
         self.assertEqual(1, len(messages))
         self.assertEqual('Hello', messages[0])
         # Channel 3
-        messages = request.connection.get_written_messages(3)
+        messages = self.request.connection.get_written_messages(3)
         self.assertEqual(1, len(messages))
         self.assertEqual('World', messages[0])
-        control_blocks = request.connection.get_written_control_blocks()
+        control_blocks = self.request.connection.get_written_control_blocks()
         # There should be 8 control blocks:
         #   - 1 NewChannelSlot
         #   - 2 AddChannelResponses for channel id 2 and 3
@@ -535,44 +657,32 @@ class MuxHandlerTest(unittest.TestCase):
         self.assertEqual(9, len(control_blocks))
 
     def test_add_channel_delta_encoding(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         delta = 'GET /echo HTTP/1.1\r\n\r\n'
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=1, encoded_handshake=delta)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=2,
                                                 replenished_quota=6,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
 
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=2, message='Hello'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_2)
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        self.assertEqual(['Hello'], dispatcher.channel_events[2].messages)
-        messages = request.connection.get_written_messages(2)
+        self.assertEqual(['Hello'], self.dispatcher.channel_events[2].messages)
+        messages = self.request.connection.get_written_messages(2)
         self.assertEqual(1, len(messages))
         self.assertEqual('Hello', messages[0])
 
     def test_add_channel_delta_encoding_override(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         # Override Sec-WebSocket-Protocol.
         delta = ('GET /echo HTTP/1.1\r\n'
@@ -580,36 +690,29 @@ class MuxHandlerTest(unittest.TestCase):
                  '\r\n')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=1, encoded_handshake=delta)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=2,
                                                 replenished_quota=6,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
 
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=2, message='Hello'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_2)
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        self.assertEqual(['Hello'], dispatcher.channel_events[2].messages)
-        messages = request.connection.get_written_messages(2)
+        self.assertEqual(['Hello'], self.dispatcher.channel_events[2].messages)
+        messages = self.request.connection.get_written_messages(2)
         self.assertEqual(1, len(messages))
         self.assertEqual('Hello', messages[0])
         self.assertEqual('x-foo',
-                         dispatcher.channel_events[2].request.ws_protocol)
+                         self.dispatcher.channel_events[2].request.ws_protocol)
 
     def test_add_channel_delta_after_identity(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
         # Sec-WebSocket-Protocol is different from client's opening handshake
         # of the physical connection.
         # TODO(bashi): Remove Upgrade, Connection, Sec-WebSocket-Key and
@@ -623,59 +726,52 @@ class MuxHandlerTest(unittest.TestCase):
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=2,
                                                 replenished_quota=6,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
 
         delta = 'GET /echo HTTP/1.1\r\n\r\n'
         add_channel_request = _create_add_channel_request_frame(
             channel_id=3, encoding=1, encoded_handshake=delta)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=3,
                                                 replenished_quota=6,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
 
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=2, message='Hello'))
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=3, message='World'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Goodbye'))
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_2)
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=3, message='Goodbye'))
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        self.assertEqual([], dispatcher.channel_events[1].messages)
-        self.assertEqual(['Hello'], dispatcher.channel_events[2].messages)
-        self.assertEqual(['World'], dispatcher.channel_events[3].messages)
+        self.assertEqual([], self.dispatcher.channel_events[1].messages)
+        self.assertEqual(['Hello'], self.dispatcher.channel_events[2].messages)
+        self.assertEqual(['World'], self.dispatcher.channel_events[3].messages)
         # Channel 2
-        messages = request.connection.get_written_messages(2)
+        messages = self.request.connection.get_written_messages(2)
         self.assertEqual(1, len(messages))
         self.assertEqual('Hello', messages[0])
         # Channel 3
-        messages = request.connection.get_written_messages(3)
+        messages = self.request.connection.get_written_messages(3)
         self.assertEqual(1, len(messages))
         self.assertEqual('World', messages[0])
         # Handshake base should be updated.
+        handshake_base = self.mux_handler._handshake_base
         self.assertEqual(
-            'x-foo',
-            mux_handler._handshake_base._headers['Sec-WebSocket-Protocol'])
+            'x-foo', handshake_base._headers['Sec-WebSocket-Protocol'])
 
     def test_add_channel_delta_remove_header(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
         # Override handshake delta base.
         encoded_handshake = (
             'GET /echo HTTP/1.1\r\n'
@@ -686,12 +782,12 @@ class MuxHandlerTest(unittest.TestCase):
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=2,
                                                 replenished_quota=6,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
 
         # Remove Sec-WebSocket-Protocol header.
         delta = ('GET /echo HTTP/1.1\r\n'
@@ -699,646 +795,468 @@ class MuxHandlerTest(unittest.TestCase):
                  '\r\n')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=3, encoding=1, encoded_handshake=delta)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=3,
                                                 replenished_quota=6,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
 
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=2, message='Hello'))
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=3, message='World'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Goodbye'))
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_2)
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=3, message='Goodbye'))
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        self.assertEqual([], dispatcher.channel_events[1].messages)
-        self.assertEqual(['Hello'], dispatcher.channel_events[2].messages)
-        self.assertEqual(['World'], dispatcher.channel_events[3].messages)
+        self.assertEqual([], self.dispatcher.channel_events[1].messages)
+        self.assertEqual(['Hello'], self.dispatcher.channel_events[2].messages)
+        self.assertEqual(['World'], self.dispatcher.channel_events[3].messages)
         # Channel 2
-        messages = request.connection.get_written_messages(2)
+        messages = self.request.connection.get_written_messages(2)
         self.assertEqual(1, len(messages))
         self.assertEqual('Hello', messages[0])
         # Channel 3
-        messages = request.connection.get_written_messages(3)
+        messages = self.request.connection.get_written_messages(3)
         self.assertEqual(1, len(messages))
         self.assertEqual('World', messages[0])
         self.assertEqual(
             'x-foo',
-            dispatcher.channel_events[2].request.ws_protocol)
+            self.dispatcher.channel_events[2].request.ws_protocol)
         self.assertEqual(
             None,
-            dispatcher.channel_events[3].request.ws_protocol)
+            self.dispatcher.channel_events[3].request.ws_protocol)
 
     def test_add_channel_invalid_encoding(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=3,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        drop_channel = next(
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
+        drop_channel = (
+            self.request.connection.get_written_control_blocks_by_opcode(
+                mux._MUX_OPCODE_DROP_CHANNEL)[0])
         self.assertEqual(mux._DROP_CODE_UNKNOWN_REQUEST_ENCODING,
                          drop_channel.drop_code)
         self.assertEqual(common.STATUS_INTERNAL_ENDPOINT_ERROR,
-                         request.connection.server_close_code)
+                         self.request.connection.server_close_code)
 
     def test_add_channel_incomplete_handshake(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         incomplete_encoded_handshake = 'GET /echo HTTP/1.1'
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=incomplete_encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        self.assertTrue(1 in dispatcher.channel_events)
-        self.assertTrue(not 2 in dispatcher.channel_events)
+        self.assertTrue(1 in self.dispatcher.channel_events)
+        self.assertTrue(not 2 in self.dispatcher.channel_events)
 
     def test_add_channel_duplicate_channel_id(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
-        encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        drop_channel = next(
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
+        drop_channel = (
+            self.request.connection.get_written_control_blocks_by_opcode(
+                mux._MUX_OPCODE_DROP_CHANNEL)[0])
         self.assertEqual(mux._DROP_CODE_CHANNEL_ALREADY_EXISTS,
                          drop_channel.drop_code)
         self.assertEqual(common.STATUS_INTERNAL_ENDPOINT_ERROR,
-                         request.connection.server_close_code)
+                         self.request.connection.server_close_code)
 
     def test_receive_drop_channel(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         drop_channel = mux._create_drop_channel(channel_id=2,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(drop_channel)
+        self.request.connection.put_bytes(drop_channel)
 
         # Terminate implicitly opened channel.
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        exception = dispatcher.channel_events[2].exception
+        exception = self.dispatcher.channel_events[2].exception
         self.assertTrue(exception.__class__ == ConnectionTerminatedException)
 
     def test_receive_ping_frame(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=2,
                                                 replenished_quota=13,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
 
         ping_frame = _create_logical_frame(channel_id=2,
                                            message='Hello World!',
                                            opcode=common.OPCODE_PING)
-        request.connection.put_bytes(ping_frame)
+        self.request.connection.put_bytes(ping_frame)
 
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_2)
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        messages = request.connection.get_written_control_messages(2)
+        messages = self.request.connection.get_written_control_messages(2)
         self.assertEqual(common.OPCODE_PONG, messages[0]['opcode'])
         self.assertEqual('Hello World!', messages[0]['message'])
 
     def test_send_ping(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         encoded_handshake = _create_request_header(path='/ping')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=2,
                                                 replenished_quota=6,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
 
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        messages = request.connection.get_written_control_messages(2)
+        messages = self.request.connection.get_written_control_messages(2)
         self.assertEqual(common.OPCODE_PING, messages[0]['opcode'])
         self.assertEqual('Ping!', messages[0]['message'])
 
     def test_send_drop_channel(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
 
         # DropChannel for channel id 1 which doesn't have reason.
         frame = create_binary_frame('\x00\x60\x01\x00', mask=True)
-        request.connection.put_bytes(frame)
+        self.request.connection.put_bytes(frame)
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        drop_channel = next(
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
+        drop_channel = (
+            self.request.connection.get_written_control_blocks_by_opcode(
+                mux._MUX_OPCODE_DROP_CHANNEL)[0])
         self.assertEqual(mux._DROP_CODE_ACKNOWLEDGED,
                          drop_channel.drop_code)
         self.assertEqual(1, drop_channel.channel_id)
 
     def test_two_flow_control(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         encoded_handshake = _create_request_header(path='/echo')
-        add_channel_request = _create_add_channel_request_frame(
-            channel_id=2, encoding=0,
-            encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
-
-        # Replenish 5 bytes.
-        flow_control = mux._create_flow_control(channel_id=2,
-                                                replenished_quota=5,
-                                                outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
-
-        # Send 10 bytes. The server will try echo back 10 bytes.
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='HelloWorld'))
-
-        # Replenish 5 + 1 (per-message extra cost) bytes.
-        flow_control = mux._create_flow_control(channel_id=2,
-                                                replenished_quota=6,
-                                                outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
-
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Goodbye'))
-
-        mux_handler.wait_until_done(timeout=2)
-
-        messages = request.connection.get_written_messages(2)
+        _put_frames(
+            self.request.connection,
+            _create_add_channel_request_frame(
+                channel_id=2, encoding=0,
+                encoded_handshake=encoded_handshake),
+            # Replenish 5 bytes.
+            mux._create_flow_control(channel_id=2, replenished_quota=5,
+                                     outer_frame_mask=True),
+            # Send 10 bytes. The server will try echo back 10 bytes.
+            _create_logical_frame(channel_id=2, message='HelloWorld'),
+            # Replenish 5 + 1 (per-message extra cost) bytes.
+            mux._create_flow_control(channel_id=2, replenished_quota=6,
+                                     outer_frame_mask=True),
+            _GOODBYE_FRAME_ON_CHANNEL_1,
+            _GOODBYE_FRAME_ON_CHANNEL_2)
+
+        self.mux_handler.wait_until_done(timeout=2)
+
+        messages = self.request.connection.get_written_messages(2)
         self.assertEqual(['HelloWorld'], messages)
+        flow_controls = (
+            self.request.connection.get_written_control_blocks_by_opcode(
+                mux._MUX_OPCODE_FLOW_CONTROL))
         received_flow_controls = [
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_FLOW_CONTROL and b.channel_id == 2]
+            b for b in flow_controls if b.channel_id == 2]
         # Replenishment for 'HelloWorld' + 1
         self.assertEqual(11, received_flow_controls[0].send_quota)
         # Replenishment for 'Goodbye' + 1
         self.assertEqual(8, received_flow_controls[1].send_quota)
 
     def test_no_send_quota_on_server(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=2, message='HelloWorld'))
 
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
 
-        mux_handler.wait_until_done(timeout=1)
+        self.mux_handler.wait_until_done(timeout=1)
 
         # No message should be sent on channel 2.
         self.assertRaises(KeyError,
-                          request.connection.get_written_messages,
+                          self.request.connection.get_written_messages,
                           2)
 
     def test_no_send_quota_on_server_for_permessage_extra_cost(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=2,
                                                 replenished_quota=6,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=2, message='Hello'))
         # Replenish only len('World') bytes.
         flow_control = mux._create_flow_control(channel_id=2,
                                                 replenished_quota=5,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
         # Server should not callback for this message.
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=2, message='World'))
 
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
 
-        mux_handler.wait_until_done(timeout=1)
+        self.mux_handler.wait_until_done(timeout=1)
 
         # Only one message should be sent on channel 2.
-        messages = request.connection.get_written_messages(2)
+        messages = self.request.connection.get_written_messages(2)
         self.assertEqual(['Hello'], messages)
 
     def test_quota_violation_by_client(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS, 0)
+        self._add_channel_slots(send_quota=0)
 
         encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=2, message='HelloWorld'))
 
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
 
-        mux_handler.wait_until_done(timeout=2)
-        control_blocks = request.connection.get_written_control_blocks()
+        self.mux_handler.wait_until_done(timeout=2)
+        control_blocks = self.request.connection.get_written_control_blocks()
         self.assertEqual(5, len(control_blocks))
-        drop_channel = next(
-            b for b in control_blocks
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
+        drop_channel = (
+            self.request.connection.get_written_control_blocks_by_opcode(
+                mux._MUX_OPCODE_DROP_CHANNEL)[0])
         self.assertEqual(mux._DROP_CODE_SEND_QUOTA_VIOLATION,
                          drop_channel.drop_code)
 
     def test_consume_quota_empty_message(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
         # Client has 1 byte quota.
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS, 1)
+        self._add_channel_slots(send_quota=1)
 
         encoded_handshake = _create_request_header(path='/echo')
         add_channel_request = _create_add_channel_request_frame(
             channel_id=2, encoding=0,
             encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
+        self.request.connection.put_bytes(add_channel_request)
 
         flow_control = mux._create_flow_control(channel_id=2,
                                                 replenished_quota=2,
                                                 outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
+        self.request.connection.put_bytes(flow_control)
         # Send an empty message. Pywebsocket always replenishes 1 byte quota
         # for empty message
-        request.connection.put_bytes(
+        self.request.connection.put_bytes(
             _create_logical_frame(channel_id=2, message=''))
 
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_1)
         # This message violates quota on channel id 2.
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Goodbye'))
+        self.request.connection.put_bytes(_GOODBYE_FRAME_ON_CHANNEL_2)
 
-        mux_handler.wait_until_done(timeout=2)
+        self.mux_handler.wait_until_done(timeout=2)
 
-        self.assertEqual(1, len(dispatcher.channel_events[2].messages))
-        self.assertEqual('', dispatcher.channel_events[2].messages[0])
+        self.assertEqual(1, len(self.dispatcher.channel_events[2].messages))
+        self.assertEqual('', self.dispatcher.channel_events[2].messages[0])
 
+        flow_controls = (
+            self.request.connection.get_written_control_blocks_by_opcode(
+                mux._MUX_OPCODE_FLOW_CONTROL))
         received_flow_controls = [
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_FLOW_CONTROL and b.channel_id == 2]
+            b for b in flow_controls if b.channel_id == 2]
         self.assertEqual(1, len(received_flow_controls))
         self.assertEqual(1, received_flow_controls[0].send_quota)
 
-        drop_channel = next(
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
+        drop_channel = (
+            self.request.connection.get_written_control_blocks_by_opcode(
+                mux._MUX_OPCODE_DROP_CHANNEL)[0])
         self.assertEqual(2, drop_channel.channel_id)
         self.assertEqual(mux._DROP_CODE_SEND_QUOTA_VIOLATION,
                          drop_channel.drop_code)
 
     def test_consume_quota_fragmented_message(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
         # Client has len('Hello') + len('Goodbye') + 2 bytes quota.
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS, 14)
+        self._add_channel_slots(send_quota=14)
 
         encoded_handshake = _create_request_header(path='/echo')
-        add_channel_request = _create_add_channel_request_frame(
-            channel_id=2, encoding=0,
-            encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
-
-        flow_control = mux._create_flow_control(channel_id=2,
-                                                replenished_quota=6,
-                                                outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
-        request.connection.put_bytes(
+        _put_frames(
+            self.request.connection,
+            _create_add_channel_request_frame(
+                channel_id=2, encoding=0,
+                encoded_handshake=encoded_handshake),
+            mux._create_flow_control(channel_id=2, replenished_quota=6,
+                                     outer_frame_mask=True),
             _create_logical_frame(channel_id=2, message='He', fin=False,
-                                  opcode=common.OPCODE_TEXT))
-        request.connection.put_bytes(
+                                  opcode=common.OPCODE_TEXT),
             _create_logical_frame(channel_id=2, message='llo', fin=True,
-                                  opcode=common.OPCODE_CONTINUATION))
+                                  opcode=common.OPCODE_CONTINUATION),
+            _GOODBYE_FRAME_ON_CHANNEL_1,
+            _GOODBYE_FRAME_ON_CHANNEL_2)
 
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Goodbye'))
+        self.mux_handler.wait_until_done(timeout=2)
 
-        mux_handler.wait_until_done(timeout=2)
-
-        messages = request.connection.get_written_messages(2)
+        messages = self.request.connection.get_written_messages(2)
         self.assertEqual(['Hello'], messages)
 
     def test_fragmented_control_message(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(mux._INITIAL_NUMBER_OF_CHANNEL_SLOTS,
-                                      mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots()
 
         encoded_handshake = _create_request_header(path='/ping')
-        add_channel_request = _create_add_channel_request_frame(
-            channel_id=2, encoding=0,
-            encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
-
-        # Replenish total 6 bytes in 3 FlowControls.
-        flow_control = mux._create_flow_control(channel_id=2,
-                                                replenished_quota=1,
-                                                outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
-
-        flow_control = mux._create_flow_control(channel_id=2,
-                                                replenished_quota=2,
-                                                outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
-
-        flow_control = mux._create_flow_control(channel_id=2,
-                                                replenished_quota=3,
-                                                outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
-
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
-
-        mux_handler.wait_until_done(timeout=2)
-
-        messages = request.connection.get_written_control_messages(2)
+        _put_frames(
+            self.request.connection,
+            _create_add_channel_request_frame(
+                channel_id=2, encoding=0,
+                encoded_handshake=encoded_handshake),
+            # Replenish total 6 bytes in 3 FlowControls.
+            mux._create_flow_control(channel_id=2, replenished_quota=1,
+                                     outer_frame_mask=True),
+            mux._create_flow_control(channel_id=2, replenished_quota=2,
+                                     outer_frame_mask=True),
+            mux._create_flow_control(channel_id=2, replenished_quota=3,
+                                     outer_frame_mask=True),
+            _GOODBYE_FRAME_ON_CHANNEL_1)
+
+        self.mux_handler.wait_until_done(timeout=2)
+
+        messages = self.request.connection.get_written_control_messages(2)
         self.assertEqual(common.OPCODE_PING, messages[0]['opcode'])
         self.assertEqual('Ping!', messages[0]['message'])
 
     def test_channel_slot_violation_by_client(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-        mux_handler.add_channel_slots(slots=1,
-                                      send_quota=mux._INITIAL_QUOTA_FOR_CLIENT)
+        self._add_channel_slots(slots=1)
 
         encoded_handshake = _create_request_header(path='/echo')
-        add_channel_request = _create_add_channel_request_frame(
-            channel_id=2, encoding=0,
-            encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
-        flow_control = mux._create_flow_control(channel_id=2,
-                                                replenished_quota=6,
-                                                outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
-
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Hello'))
-
-        # This request should be rejected.
-        encoded_handshake = _create_request_header(path='/echo')
-        add_channel_request = _create_add_channel_request_frame(
-            channel_id=3, encoding=0,
-            encoded_handshake=encoded_handshake)
-        request.connection.put_bytes(add_channel_request)
-        flow_control = mux._create_flow_control(channel_id=3,
-                                                replenished_quota=6,
-                                                outer_frame_mask=True)
-        request.connection.put_bytes(flow_control)
-
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=3, message='Hello'))
-
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=1, message='Goodbye'))
-        request.connection.put_bytes(
-            _create_logical_frame(channel_id=2, message='Goodbye'))
-
-        mux_handler.wait_until_done(timeout=2)
-
-        self.assertEqual([], dispatcher.channel_events[1].messages)
-        self.assertEqual(['Hello'], dispatcher.channel_events[2].messages)
-        self.assertFalse(dispatcher.channel_events.has_key(3))
-        drop_channel = next(
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
+        _put_frames(
+            self.request.connection,
+            _create_add_channel_request_frame(
+                channel_id=2, encoding=0,
+                encoded_handshake=encoded_handshake),
+            mux._create_flow_control(channel_id=2, replenished_quota=6,
+                                     outer_frame_mask=True),
+            _create_logical_frame(channel_id=2, message='Hello'),
+            # This request should be rejected.
+            _create_add_channel_request_frame(
+                channel_id=3, encoding=0,
+                encoded_handshake=encoded_handshake),
+            mux._create_flow_control(channel_id=3, replenished_quota=6,
+                                     outer_frame_mask=True),
+            _create_logical_frame(channel_id=3, message='Hello'),
+            _GOODBYE_FRAME_ON_CHANNEL_1,
+            _GOODBYE_FRAME_ON_CHANNEL_2)
+
+        self.mux_handler.wait_until_done(timeout=2)
+
+        self.assertEqual([], self.dispatcher.channel_events[1].messages)
+        self.assertEqual(['Hello'], self.dispatcher.channel_events[2].messages)
+        self.assertNotIn(3, self.dispatcher.channel_events)
+        drop_channel = (
+            self.request.connection.get_written_control_blocks_by_opcode(
+                mux._MUX_OPCODE_DROP_CHANNEL)[0])
         self.assertEqual(3, drop_channel.channel_id)
         self.assertEqual(mux._DROP_CODE_NEW_CHANNEL_SLOT_VIOLATION,
                          drop_channel.drop_code)
 
-    def test_invalid_encapsulated_message(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
+    def _assert_physical_connection_dropped(self, frame, drop_code):
+        self.request.connection.put_bytes(frame)
+
+        self.mux_handler.wait_until_done(timeout=2)
+
+        drop_channel = (
+            self.request.connection.get_written_control_blocks_by_opcode(
+                mux._MUX_OPCODE_DROP_CHANNEL)[0])
+        self.assertEqual(drop_code, drop_channel.drop_code)
+        self.assertEqual(common.STATUS_INTERNAL_ENDPOINT_ERROR,
+                         self.request.connection.server_close_code)
 
+    def test_invalid_encapsulated_message(self):
         first_byte = (mux._MUX_OPCODE_ADD_CHANNEL_REQUEST << 5)
-        block = (chr(first_byte) +
-                 mux._encode_channel_id(1) +
-                 mux._encode_number(0))
-        payload = mux._encode_channel_id(mux._CONTROL_CHANNEL_ID) + block
+        payload = ''.join([mux._encode_channel_id(mux._CONTROL_CHANNEL_ID),
+                           chr(first_byte),
+                           mux._encode_channel_id(1),
+                           mux._encode_number(0)])
         text_frame = create_binary_frame(payload, opcode=common.OPCODE_TEXT,
                                          mask=True)
-        request.connection.put_bytes(text_frame)
-
-        mux_handler.wait_until_done(timeout=2)
-
-        drop_channel = next(
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
-        self.assertEqual(mux._DROP_CODE_INVALID_ENCAPSULATING_MESSAGE,
-                         drop_channel.drop_code)
-        self.assertEqual(common.STATUS_INTERNAL_ENDPOINT_ERROR,
-                         request.connection.server_close_code)
+        self._assert_physical_connection_dropped(
+            text_frame, mux._DROP_CODE_INVALID_ENCAPSULATING_MESSAGE)
 
     def test_channel_id_truncated(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-
         # The last byte of the channel id is missing.
-        frame = create_binary_frame('\x80', mask=True)
-        request.connection.put_bytes(frame)
-
-        mux_handler.wait_until_done(timeout=2)
-
-        drop_channel = next(
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
-        self.assertEqual(mux._DROP_CODE_CHANNEL_ID_TRUNCATED,
-                         drop_channel.drop_code)
-        self.assertEqual(common.STATUS_INTERNAL_ENDPOINT_ERROR,
-                         request.connection.server_close_code)
+        self._assert_physical_connection_dropped(
+            create_binary_frame('\x80', mask=True),
+            mux._DROP_CODE_CHANNEL_ID_TRUNCATED)
 
     def test_inner_frame_truncated(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-
         # Just contain channel id 1.
-        frame = create_binary_frame('\x01', mask=True)
-        request.connection.put_bytes(frame)
-
-        mux_handler.wait_until_done(timeout=2)
-
-        drop_channel = next(
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
-        self.assertEqual(mux._DROP_CODE_ENCAPSULATED_FRAME_IS_TRUNCATED,
-                         drop_channel.drop_code)
-        self.assertEqual(common.STATUS_INTERNAL_ENDPOINT_ERROR,
-                         request.connection.server_close_code)
+        self._assert_physical_connection_dropped(
+            create_binary_frame('\x01', mask=True),
+            mux._DROP_CODE_ENCAPSULATED_FRAME_IS_TRUNCATED)
 
     def test_unknown_mux_opcode(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-
         # Undefined opcode 5
-        frame = create_binary_frame('\x00\xa0', mask=True)
-        request.connection.put_bytes(frame)
-
-        mux_handler.wait_until_done(timeout=2)
-
-        drop_channel = next(
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
-        self.assertEqual(mux._DROP_CODE_UNKNOWN_MUX_OPCODE,
-                         drop_channel.drop_code)
-        self.assertEqual(common.STATUS_INTERNAL_ENDPOINT_ERROR,
-                         request.connection.server_close_code)
+        self._assert_physical_connection_dropped(
+            create_binary_frame('\x00\xa0', mask=True),
+            mux._DROP_CODE_UNKNOWN_MUX_OPCODE)
 
     def test_invalid_mux_control_block(self):
-        request = _create_mock_request()
-        dispatcher = _MuxMockDispatcher()
-        mux_handler = mux._MuxHandler(request, dispatcher)
-        mux_handler.start()
-
         # DropChannel contains 1 byte reason
-        frame = create_binary_frame('\x00\x60\x00\x01\x00', mask=True)
-        request.connection.put_bytes(frame)
-
-        mux_handler.wait_until_done(timeout=2)
-
-        drop_channel = next(
-            b for b in request.connection.get_written_control_blocks()
-            if b.opcode == mux._MUX_OPCODE_DROP_CHANNEL)
-        self.assertEqual(mux._DROP_CODE_INVALID_MUX_CONTROL_BLOCK,
-                         drop_channel.drop_code)
-        self.assertEqual(common.STATUS_INTERNAL_ENDPOINT_ERROR,
-                         request.connection.server_close_code)
+        self._assert_physical_connection_dropped(
+            create_binary_frame('\x00\x60\x00\x01\x00', mask=True),
+            mux._DROP_CODE_INVALID_MUX_CONTROL_BLOCK)
 
 if __name__ == '__main__':
     unittest.main()
@@ -69,6 +69,15 @@ class StreamTest(unittest.TestCase):
                           stream.create_header,
                           common.OPCODE_TEXT, 1 << 63, 0, 0, 0, 0, 0)
 
+    def test_create_text_frame(self):
+        self.assertEqual('\x81\x02\xc3\xa9',
+                         stream.create_text_frame(u'\u00e9'))
+        # ASCII str is sent as is.
+        self.assertEqual('\x81\x05Hello', stream.create_text_frame('Hello'))
+        # Non-ASCII str is rejected as str.encode('utf-8') would reject it.
+        self.assertRaises(UnicodeDecodeError,
+                          stream.create_text_frame, '\xc3\xa9')
+
 
 if __name__ == '__main__':
     unittest.main()